@@ -1,10 +1,14 @@
 from enum import Enum, auto
 import kkdlib
 from pathlib import Path
-from PIL import Image, ImageFile, ImageOps
-from PIL.Image import Transpose
-from dataclasses import dataclass, field
-from typing import ClassVar
+from PIL import Image, ImageFile, ImageOps, ImageStat
+from dataclasses import dataclass
+from lib import Instrument, FarcWriter
+from lib.IdAllocator import IdAllocator
+
+import logging
+
+logger = logging.getLogger('FarcCreater')
 
 class Compression(Enum):
     BC7 = "BC7"
@@ -36,21 +40,154 @@ class Compression(Enum):
                 return "MERGE_BC7COMP"
             case Compression.RGBA:
                 return "MERGE_NOCOMP"
+
+class EncodePreset(Enum):
+    '''
+    速度与画质的取舍，在创建Farc时决定实际使用的压缩格式
+    '''
+    DRAFT = "draft"     # 预览用，有损压缩统一使用编码最快的DXT5(BC3)
+    RELEASE = "release" # 使用Farc指定的压缩格式
+    RAW = "raw"         # 不压缩
+
+    def apply(self, compression:Compression) -> Compression:
+        match self:
+            case EncodePreset.DRAFT:
+                return compression if compression is Compression.RGBA else Compression.DXT5
+            case EncodePreset.RAW:
+                return Compression.RGBA
+        return compression
+
+class TextureEncoder:
+    '''
+    贴图编码后端
+    function_dict记录每种压缩格式使用的kkdlib函数名，YCbCr没有格式参数
+    '''
+    name : str = ""
+    function_dict : dict[Compression, str] = {}
+
+    def supports(self, compression:Compression) -> bool:
+        return hasattr(kkdlib.txp.Texture, self.function_dict.get(compression, "")) #type:ignore
+
+    def encode(self, width:int, height:int, data:bytes, compression:Compression):
+        func = getattr(kkdlib.txp.Texture, self.function_dict[compression]) #type:ignore
+        if compression is Compression.ATI2:
+            return func(width, height, data)
+        return func(width, height, data, compression.to_kkdlib_format())
+
+class KKdLibEncoder(TextureEncoder):
+    name = "kkdlib"
+    function_dict = {Compression.ATI2:"py_ycbcr_from_rgba_gpu", Compression.DXT5:"py_from_rgba_gpu",
+                     Compression.BC7:"py_from_rgba_gpu", Compression.RGBA:"py_from_rgba_gpu"}
+
+class KKdLibLegacyEncoder(TextureEncoder):
+    '''
+    旧版本kkdlib中同一个编码器的函数名，与KKdLibEncoder通常只有一个可用
+    '''
+    name = "kkdlib_legacy"
+    function_dict = {Compression.ATI2:"encode_ycbcr", Compression.DXT5:"py_from_rgba",
+                     Compression.BC7:"py_from_rgba", Compression.RGBA:"py_from_rgba"}
+
+# 按注册顺序优先，自动选择时使用第一个支持该压缩格式的后端
+ENCODER_REGISTRY : dict[str, TextureEncoder] = {}
+
+def register_encoder(encoder:TextureEncoder) -> None:
+    ENCODER_REGISTRY[encoder.name] = encoder
+
+register_encoder(KKdLibEncoder())
+register_encoder(KKdLibLegacyEncoder())
+
+def get_encoder(compression:Compression, name:str|None = None) -> TextureEncoder:
+    '''
+    name为None时使用第一个支持该压缩格式的后端
+    '''
+    if name is not None:
+        encoder = ENCODER_REGISTRY[name]
+        if not encoder.supports(compression):
+            raise ValueError(f"编码后端 {name} 不支持 {compression}")
+        return encoder
+    for encoder in ENCODER_REGISTRY.values():
+        if encoder.supports(compression):
+            return encoder
+    raise RuntimeError(f"没有可用的编码后端支持 {compression}")
+
 @dataclass
-class txp_info:
-    _id_count:ClassVar[int] = 0
-    
-    id:int = field(init=False)
-    data:Image.Image
-    width:float = field(init=False)
-    height:float = field(init=False)
-    
+class FarcSetting:
+    '''
+    生成farc时的设置，由每个Farc自己持有，不使用模块级的全局状态
+    encoder为None或auto时自动选择
+    farc_level为0-9的gzip压缩等级，None时输出不压缩的farc
+    farc_workers为并行压缩的线程数，None时使用全部核心
+    '''
+    encoder : str|None = None
+    preset : EncodePreset = EncodePreset.RELEASE
+    farc_level : int|None = None
+    farc_workers : int|None = None
+
     def __post_init__(self) -> None:
-        self.id = self._id_count
-        type(self)._id_count += 1
-        
-        self.width = self.data.width
-        self.height = self.data.height
+        if self.encoder == "auto":
+            self.encoder = None
+        if self.encoder is not None and self.encoder not in ENCODER_REGISTRY:
+            raise ValueError(f"未知的编码后端 {self.encoder}，可选：{', '.join(ENCODER_REGISTRY)}")
+
+# 各通道方差都低于该值时视为纯色贴图
+FLAT_VARIANCE = 4.0
+
+@dataclass
+class TextureStats:
+    is_empty : bool   # 完全透明
+    is_opaque : bool  # 完全不透明
+    max_variance : float
+
+def analyze_texture(image:Image.Image) -> TextureStats:
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    alpha_min, alpha_max = image.getextrema()[3]
+    return TextureStats(is_empty = alpha_max == 0,
+                        is_opaque = alpha_min == 255,
+                        max_variance = max(ImageStat.Stat(image).var))
+
+def choose_compression(stats:TextureStats, compression:Compression) -> Compression:
+    '''
+    在满足画质的前提下选择编码最快、体积合适的格式
+    完全透明     : DXT5，保留原尺寸，sprite的范围仍然有效，透明块压缩后无损
+    纯色         : DXT5，块压缩对纯色几乎无损
+    完全不透明   : BC7换为YCbCr，不需要BC7的透明度精度
+    指定不压缩时不做调整
+    '''
+    if compression is Compression.RGBA:
+        return compression
+    if stats.is_empty:
+        return Compression.DXT5
+    if stats.max_variance < FLAT_VARIANCE:
+        return Compression.DXT5
+    if stats.is_opaque and compression is Compression.BC7:
+        return Compression.ATI2
+    return compression
+
+@dataclass
+class txp_info:
+    '''
+    data为RGBA8像素，编码后立即释放
+    id由所属Farc分配
+    '''
+    id:int
+    data:bytes|None
+    width:int
+    height:int
+    compression:Compression
+
+    @classmethod
+    def from_image(cls, id:int, image:Image.Image, compression:Compression, flip:bool = True) -> "txp_info":
+        '''
+        flip为True时上下翻转
+        raw编码器的orientation为-1时从最后一行开始输出，不需要Transpose生成翻转后的整张图
+        '''
+        if image.mode != "RGBA":
+            image = image.convert("RGBA")
+        return cls(id, image.tobytes("raw", "RGBA", 0, -1 if flip else 1), image.width, image.height, compression)
+
+    def release(self) -> None:
+        self.data = None
         
 @dataclass
 class spr_info:
@@ -61,15 +198,34 @@ class spr_info:
     height:float
 
 class Farc:
-    def __init__(self, compression:Compression = Compression.RGBA) -> None:
-        txp_info._id_count = 0 # 初始化ID
-        self.compression:Compression = compression
+    '''
+    content_aware为True时根据每张贴图的内容选择压缩格式，否则全部使用compression
+    贴图ID、编码后端与设置都由实例自己保存，多个Farc可以同时在不同线程中构建
+    '''
+    def __init__(self, compression:Compression = Compression.RGBA, content_aware:bool = False,
+                 texture_id_start:int = 0, setting:FarcSetting|None = None) -> None:
+        self.texture_id:IdAllocator = IdAllocator(texture_id_start)
+        self.setting:FarcSetting = setting or FarcSetting()
+        self.compression:Compression = self.setting.preset.apply(compression)
+        # 每种压缩格式使用的编码后端，第一次编码时选择
+        self.encoder_dict:dict[Compression, TextureEncoder] = {}
+        self.content_aware:bool = content_aware
         self.texture_dict:dict[str, txp_info] = {}
         self.sprit_dict  :dict[str, spr_info] = {}
     
-    def add_texture(self, data:Image.Image) -> int:
-        info = txp_info(data)
-        name:str = f"{self.compression.default_spr_name()}_{info.id}"
+    def add_texture(self, data:Image.Image, flip:bool = True) -> int:
+        '''
+        只保存像素数据，不持有Image
+        '''
+        compression = self.compression
+        if self.content_aware:
+            stats = analyze_texture(data)
+            compression = choose_compression(stats, compression)
+            if compression is not self.compression:
+                logger.debug(f"贴图 {data.size} 使用 {compression} 代替 {self.compression}")
+        info = txp_info.from_image(self.texture_id.allocate(), data, compression, flip)
+        Instrument.count(f"texture_{compression.name}")
+        name:str = f"{compression.default_spr_name()}_{info.id}"
         self.texture_dict.update({name:info})
         
         return info.id
@@ -86,25 +242,26 @@ class Farc:
     
     def _convert_to_texture(self, info:txp_info):
         '''
-        新旧版本命名不一致，在这里进行统一处理
+        新旧版本kkdlib命名不一致，由编码后端统一处理
         '''
-        if self.compression is Compression.ATI2:
-            if hasattr(kkdlib.txp.Texture,"py_ycbcr_from_rgba_gpu"): #type:ignore
-                return kkdlib.txp.Texture.py_ycbcr_from_rgba_gpu(info.width, info.height, info.data.tobytes()) #type:ignore
-            else:
-                return kkdlib.txp.Texture.encode_ycbcr(info.width, info.height, info.data.tobytes()) #type:ignore
-        else:
-            if hasattr(kkdlib.txp.Texture,"py_from_rgba_gpu"): #type:ignore
-                return kkdlib.txp.Texture.py_from_rgba_gpu(info.width, info.height, info.data.tobytes(), self.compression.to_kkdlib_format()) #type:ignore
-            else:
-                return kkdlib.txp.Texture.py_from_rgba(info.width, info.height, info.data.tobytes(), self.compression.to_kkdlib_format()) #type:ignore
+        encoder = self.encoder_dict.get(info.compression)
+        if encoder is None:
+            encoder = get_encoder(info.compression, self.setting.encoder)
+            logger.debug(f"{info.compression} 使用编码后端 {encoder.name}")
+            self.encoder_dict[info.compression] = encoder
+        return encoder.encode(info.width, info.height, info.data, info.compression)
+
     def export_farc(self, export_name:str, export_path:Path, aft_mode:bool=False) -> None:
         txp = kkdlib.txp.Set() #type:ignore
         name_list:list[str] = [] #记录Texture名称
         # 添加texture
-        for name,info in self.texture_dict.items():
-            name_list.append(name)
-            txp.add_file(self._convert_to_texture(info))
+        with Instrument.stage("encode_texture"):
+            for name,info in self.texture_dict.items():
+                name_list.append(name)
+                txp.add_file(self._convert_to_texture(info))
+                info.release()
+                Instrument.count("textures")
+                Instrument.count("pixels", info.width * info.height)
    
         
         spr_bin = kkdlib.spr.Set() #type:ignore
@@ -124,45 +281,84 @@ class Farc:
             #添加到spr
             spr_bin.add_spr(info, name)
 
-        farc = kkdlib.farc.Farc() #type:ignore
-        farc.add_file_data(f"{export_name}.bin", spr_bin.to_buf())
-        farc.write(str(export_path.joinpath(f"{export_name}.farc")), False, False)
+        spr_buf = spr_bin.to_buf()
+        Instrument.count("bytes", len(spr_buf))
+        farc_path = export_path.joinpath(f"{export_name}.farc")
+        if self.setting.farc_level is None:
+            farc = kkdlib.farc.Farc() #type:ignore
+            farc.add_file_data(f"{export_name}.bin", spr_buf)
+            farc.write(str(farc_path), False, False)
+        else:
+            with Instrument.stage("compress_farc"):
+                size = FarcWriter.write_farc(farc_path, [(f"{export_name}.bin", spr_buf)],
+                                             self.setting.farc_level, self.setting.farc_workers)
+                Instrument.count("bytes", size)
+
+# 解码时保留的目标尺寸倍数，最终缩放仍由ImageOps完成，画质不受影响
+DECODE_MARGIN = 2
+
+def get_reduce_factor(src_size:tuple[int,int], dst_size:tuple[int,int], cover:bool = True) -> int:
+    '''
+    cover为True时对应ImageOps.fit（裁切填满），False时对应ImageOps.pad（完整放入）
+    返回整数缩小倍数，缩小后仍不小于目标尺寸的DECODE_MARGIN倍
+    '''
+    ratio_list = (src_size[0] / dst_size[0], src_size[1] / dst_size[1])
+    ratio = min(ratio_list) if cover else max(ratio_list)
+    return max(int(ratio / DECODE_MARGIN), 1)
+
+def open_image(path:Path, size:tuple[int,int], cover:bool = True) -> Image.Image:
+    '''
+    按目标尺寸降低解码分辨率
+    JPEG使用draft直接以1/2、1/4、1/8解码，其他格式解码后先用reduce整数倍缩小
+    '''
+    img = Image.open(path)
+    factor = get_reduce_factor(img.size, size, cover)
+    if factor > 1:
+        img.draft(None, (-(-img.width // factor), -(-img.height // factor)))
+        factor = get_reduce_factor(img.size, size, cover)
+    if img.mode not in ("RGB", "RGBA", "L", "LA"):
+        img = img.convert("RGBA")
+    if factor > 1:
+        img = img.reduce(factor)
+    Instrument.count("decoded_pixels", img.width * img.height)
+    return img
 
 def create_sel_texture_0(bg_path:Path, jk_path:Path|None = None) -> Image.Image:
     img_data = Image.new("RGBA",(2048, 1024))
     if not jk_path:
         jk_path = bg_path
 
-    jk_img = ImageOps.fit(Image.open(jk_path), (500,500))
-    bg_img = ImageOps.fit(Image.open(bg_path), (1280,720))
+    jk_img = ImageOps.fit(open_image(jk_path, (500,500)), (500,500))
+    bg_img = ImageOps.fit(open_image(bg_path, (1280,720)), (1280,720))
     
     img_data.paste(bg_img)
     img_data.paste(jk_img, (1287,3 ,1787,503))
     
-    return img_data.transpose(Transpose.FLIP_TOP_BOTTOM)
+    # 上下翻转在Farc.add_texture中完成
+    return img_data
 
 def create_sel_texture_1(logo_path:Path|None) -> Image.Image:
     img_data = Image.new("RGBA",(1024, 512))
     if logo_path:
-        logo_img = ImageOps.pad(Image.open(logo_path).convert("RGBA"), (870,330))
+        logo_img = ImageOps.pad(open_image(logo_path, (870,330), cover=False).convert("RGBA"), (870,330))
         img_data.paste(logo_img)
 
-    return img_data.transpose(Transpose.FLIP_TOP_BOTTOM)
+    return img_data
 
-def create_spr_sel_farc(pv_id:int, spr_path_dict:dict[str,Path], export_path:Path, compression:Compression = Compression.ATI2):
-    farc = Farc(compression)
-    
-    texture_0 = create_sel_texture_0(spr_path_dict.pop("bg_path"), spr_path_dict.pop("jk_path"))
-    texture_1 = create_sel_texture_1(spr_path_dict.pop("logo_path", None))
-    
-    bg_jk_index = farc.add_texture(texture_0)
-    logo_index  = farc.add_texture(texture_1)
-    
-    farc.add_sprite(f"SONG_BG{pv_id:03d}", setting=(bg_jk_index, 2, 2, 1280, 720))
-    farc.add_sprite(f"SONG_JK{pv_id:03d}", setting=(bg_jk_index, 1286, 2, 502, 502))
-    farc.add_sprite(f"SONG_LOGO{pv_id:03d}", setting=(logo_index, 2, 2, 870, 330))
-    
-    farc.export_farc(f"spr_sel_pv{pv_id:03d}", export_path)
+def create_spr_sel_farc(pv_id:int, spr_path_dict:dict[str,Path], export_path:Path, compression:Compression = Compression.ATI2,
+                        setting:FarcSetting|None = None):
+    with Instrument.stage("create_spr_sel_farc"):
+        farc = Farc(compression, content_aware=True, setting=setting)
+        
+        # 不保留Image，添加后即可释放
+        bg_jk_index = farc.add_texture(create_sel_texture_0(spr_path_dict.pop("bg_path"), spr_path_dict.pop("jk_path")))
+        logo_index  = farc.add_texture(create_sel_texture_1(spr_path_dict.pop("logo_path", None)))
+        
+        farc.add_sprite(f"SONG_BG{pv_id:03d}", setting=(bg_jk_index, 2, 2, 1280, 720))
+        farc.add_sprite(f"SONG_JK{pv_id:03d}", setting=(bg_jk_index, 1286, 2, 502, 502))
+        farc.add_sprite(f"SONG_LOGO{pv_id:03d}", setting=(logo_index, 2, 2, 870, 330))
+        
+        farc.export_farc(f"spr_sel_pv{pv_id:03d}", export_path)
     
 if __name__ == "__main__":
     image_info = {"bg_path":Path("SONG_BG_DUMMY.png"),
@@ -1,9 +1,20 @@
 import zlib
+import struct
 from pathlib import Path
-from pprint import pprint
+from pprint import pformat
 import hashlib
 from io import BytesIO
+from collections.abc import Callable
+from dataclasses import dataclass, field, asdict
+import json
+import time
+import os
+import logging
 from diva_lib.hash import CalculateStr
+from lib import Instrument
+from lib.IdAllocator import IdAllocator
+
+logger = logging.getLogger('auto_creat_mod_spr_db')
 
 '''
 def get_hash(string):
@@ -15,113 +26,254 @@ def get_hash(string):
 
 def get_hash(string):
     return CalculateStr(string)
+
+# mod_spr_db中的记录结构
+DB_HEAD = struct.Struct("<IIII")       # SpriteSetInfo数量, 地址, Sprites数量, 地址
+SPRITE_SET_INFO = struct.Struct("<IIII") # id, 名称地址, 文件名地址, info_id
+SPRITES = struct.Struct("<IIHH")        # id, 名称地址, index, info_id（贴图加上0x1000）
+TEXTURE_FLAG = 0x1000
+
+def get_str(data:bytes, start:int) -> str:
+    '''
+    读取以\x00结尾的字符串，data为整个文件的数据
+    '''
+    end = data.find(b"\x00", start)
+    return str(data[start:end if end != -1 else None], "utf-8")
     
 
 class farc_format:
     AFT = b"FArC"
     Gzip = b"\x00\x00\x00\x10"
 
+class Progress:
+    '''
+    进度与统计信息
+    count记录处理条数，bytes记录写入字节数
+    回调按interval（秒）限流，避免逐条输出拖慢处理
+    quiet为True时不触发任何回调
+    '''
+    def __init__(self, name:str, total:int = 0,
+                 callback:Callable[["Progress"], None]|None = None,
+                 interval:float = 0.5, quiet:bool = False) -> None:
+        self.name = name
+        self.total = total
+        self.callback = callback if callback else log_progress
+        self.interval = interval
+        self.quiet = quiet
+
+        self.count = 0
+        self.bytes = 0
+        self.start_time = time.perf_counter()
+        self.end_time:float|None = None
+        self._last_report = self.start_time
+
+    @property
+    def elapsed(self) -> float:
+        end_time = self.end_time if self.end_time is not None else time.perf_counter()
+        return end_time - self.start_time
+
+    @property
+    def rate(self) -> float:
+        '''
+        每秒处理条数
+        '''
+        elapsed = self.elapsed
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def percent(self) -> float:
+        return self.count / self.total * 100 if self.total else 100.0
+
+    @property
+    def done(self) -> bool:
+        return self.end_time is not None
+
+    def update(self, count:int = 1, nbytes:int = 0) -> None:
+        self.count += count
+        self.bytes += nbytes
+        if self.quiet:
+            return
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.callback(self)
+
+    def finish(self) -> "Progress":
+        self.end_time = time.perf_counter()
+        if not self.quiet:
+            self.callback(self)
+        return self
+
+def log_progress(progress:Progress) -> None:
+    if progress.done:
+        bytes_str = f", {progress.bytes} bytes" if progress.bytes else ""
+        logger.info(f"{progress.name}: {progress.count} entries{bytes_str}, "
+                    f"{progress.elapsed:.2f}s ({progress.rate:.0f} entries/s)")
+    else:
+        logger.info(f"{progress.name}: {progress.percent:.2f}% ({progress.rate:.0f} entries/s)")
+
+class StringPool:
+    '''
+    mod_spr_db的字符串区，相同的字符串只写入一次
+    share_suffix为True时，是其他字符串后缀的字符串直接指向该字符串的尾部
+    先add全部字符串，build后才能get地址
+    '''
+    def __init__(self, share_suffix:bool = False) -> None:
+        self.share_suffix = share_suffix
+        # 按添加顺序保存，build后值为地址
+        self.offset_dict:dict[str,int] = {}
+        self.count = 0
+
+    def add(self, string:str) -> None:
+        self.count += 1
+        self.offset_dict.setdefault(string, -1)
+
+    def get(self, string:str) -> int:
+        return self.offset_dict[string]
+
+    def build(self, start:int) -> bytes:
+        '''
+        start为字符串区在文件中的地址，返回字符串区的数据
+        '''
+        data = bytearray()
+        encoded_dict = {string:string.encode("utf-8") for string in self.offset_dict}
+        if not self.share_suffix:
+            for string, encoded in encoded_dict.items():
+                self.offset_dict[string] = start + len(data)
+                data += encoded + b"\x00"
+            return bytes(data)
+
+        # 按反转后的内容降序排列，是后缀的字符串紧跟在包含它的字符串之后
+        previous = b""
+        previous_end = 0
+        for string in sorted(encoded_dict, key=lambda string: encoded_dict[string][::-1], reverse=True):
+            encoded = encoded_dict[string]
+            if previous.endswith(encoded):
+                self.offset_dict[string] = start + previous_end - len(encoded)
+                continue
+            self.offset_dict[string] = start + len(data)
+            data += encoded + b"\x00"
+            previous = encoded
+            previous_end = len(data) - 1
+        return bytes(data)
+
+@dataclass
+class MergeConflict:
+    '''
+    合并后id相同的两条记录
+    名称不同时为哈希碰撞，名称相同时为不同farc中的重复名称
+    '''
+    id : int
+    kept_str : str
+    kept_file : str
+    other_str : str
+    other_file : str
+    source : str # 后出现的记录所在的数据库
+
+    @property
+    def is_collision(self) -> bool:
+        return self.kept_str != self.other_str
+
+@dataclass
+class MergeReport:
+    source_list : list[str]
+    remap_list : list[tuple[str, str, int, int]] = field(default_factory=list) # 数据库, 文件名, 原info_id, 新info_id
+    override_list : list[tuple[str, str]] = field(default_factory=list)        # 数据库, 文件名
+    set_conflict_list : list[MergeConflict] = field(default_factory=list)
+    spr_conflict_list : list[MergeConflict] = field(default_factory=list)
+
+    @property
+    def collision_count(self) -> int:
+        return sum(conflict.is_collision for conflict in self.set_conflict_list + self.spr_conflict_list)
+
 class Manager:
-    def __init__(self):
+    '''
+    info_id由实例自己的分配器分配，从info_id_start开始
+    读取已有数据库时跳过已使用的info_id
+    Manager之间没有共享的状态，每个Manager只在一个线程中使用时，多个Manager可以同时构建
+    '''
+    def __init__(self, quiet:bool = False, progress_callback:Callable[[Progress], None]|None = None,
+                 info_id_start:int = 0):
         self.sprinfo_list = list()
         self.spr_list = list()
         self.sprinfo_id_dict = {}
         self.sprinfo_file_name_dict = {}
         self.pvtmb = None
+        self.info_id = IdAllocator(info_id_start)
+        # quiet用于批处理，关闭进度输出
+        self.quiet = quiet
+        self.progress_callback = progress_callback
+
+    def new_progress(self, name:str, total:int = 0) -> Progress:
+        return Progress(name, total, self.progress_callback, quiet=self.quiet)
 
     def read_db(self,_file_path):
+        '''
+        一次读入整个文件，按记录结构批量解析
+        '''
         with open(_file_path,"rb") as f:
-            info_len = f.read(16)
-            SpriteSetInfo_list = {"len":int.from_bytes(info_len[0:4],"little"),
-                                "start":int.from_bytes(info_len[4:8],"little"),
-                                }
-            Sprites_list = {"len":int.from_bytes(info_len[8:12],"little"),
-                            "start":int.from_bytes(info_len[12:16],"little"),
-                            }
-            for i in range(SpriteSetInfo_list["len"]):
-                f.seek(SpriteSetInfo_list["start"] + i * 16)
-                self.add_spr(SpriteSetInfo(f.read(16), f))
-                if SpriteSetInfo.max_info_id < self.sprinfo_list[-1].info_id:
-                    SpriteSetInfo.max_info_id = self.sprinfo_list[-1].info_id
-
-            for i in range(Sprites_list["len"]):
-                f.seek(Sprites_list["start"] + i * 12)
-                self.add_spr(Sprites(f.read(12),f))
+            data = f.read()
+        sprinfo_len, sprinfo_start, spr_len, spr_start = DB_HEAD.unpack_from(data)
+        sprinfo_end = sprinfo_start + sprinfo_len * SPRITE_SET_INFO.size
+        for record in SPRITE_SET_INFO.iter_unpack(data[sprinfo_start:sprinfo_end]):
+            self.add_spr(SpriteSetInfo.from_record(record, data))
+
+        spr_end = spr_start + spr_len * SPRITES.size
+        for record in SPRITES.iter_unpack(data[spr_start:spr_end]):
+            self.add_spr(Sprites.from_record(record, data))
                 
-    def write_db(self,_file_path):
+    def write_db(self, _file_path, share_suffix:bool = False) -> Progress:
+        '''
+        先在内存中生成全部数据再一次写入
+        字符串区去重，没有重复字符串时与逐条写入的结果一致
+        '''
         len_sprinfo = len(self.sprinfo_list)
         len_spr = len(self.spr_list)
-        sprinfo_start = 16
-        spr_start = len_sprinfo * 16 + sprinfo_start
-        spr_no_data_lenght = 16 - ((len_spr * 12) % 16)
-        str_start = spr_start + (len_spr * 12) + spr_no_data_lenght
-
-        with open(_file_path,"wb+") as f:
-            #write head info
-            f.write(len_sprinfo.to_bytes(4,byteorder="little"))
-            f.write(sprinfo_start.to_bytes(4,byteorder="little"))
-            f.write(len_spr.to_bytes(4,byteorder="little"))
-            f.write(spr_start.to_bytes(4,byteorder="little"))
-            max_len = len(self.sprinfo_list)
-            for i in range(len(self.sprinfo_list)):
-                process = i/max_len
-                process = str(process * 100)[:5]
-                sprinfo =  self.sprinfo_list[i]
-                print(f"\rCreat new mod_spr_db:{process}%",end="")
-                #write sprinfo
-                #write id
-                f.seek(sprinfo_start)
-                f.write(sprinfo.id.to_bytes(4,byteorder="little"))
-                #write str start point
-                f.write(str_start.to_bytes(4,byteorder="little"))
-                #write file str start point
-                file_str_start = len(sprinfo.info_str) + str_start + 1
-                f.write(file_str_start.to_bytes(4,byteorder="little"))
-                #wrile info id
-                f.write(sprinfo.info_id.to_bytes(4,byteorder="little"))
-
-                sprinfo_start += 16
-
-                #write str
-                f.seek(str_start)
-                f.write(sprinfo.info_str.encode("UTF-8"))
-                f.write(b"\x00")
-                f.write(sprinfo.file_str.encode("UTF-8"))
-
-                str_start = f.tell() + 1
+        sprinfo_start = DB_HEAD.size
+        spr_start = len_sprinfo * SPRITE_SET_INFO.size + sprinfo_start
+        spr_no_data_lenght = 16 - ((len_spr * SPRITES.size) % 16)
+        str_start = spr_start + (len_spr * SPRITES.size) + spr_no_data_lenght
+
+        progress = self.new_progress("Creat new mod_spr_db", len_sprinfo)
+        with Instrument.stage("write_db"):
+            pool = StringPool(share_suffix)
+            for sprinfo in self.sprinfo_list:
+                pool.add(sprinfo.info_str)
+                pool.add(sprinfo.file_str)
+                for k in sprinfo.Sprites_list + sprinfo.Textures_list:
+                    pool.add(k.info_str)
+            str_data = pool.build(str_start)
+
+            data = bytearray(str_start)
+            DB_HEAD.pack_into(data, 0, len_sprinfo, sprinfo_start, len_spr, spr_start)
+            for sprinfo in self.sprinfo_list:
+                SPRITE_SET_INFO.pack_into(data, sprinfo_start, sprinfo.id, pool.get(sprinfo.info_str),
+                                          pool.get(sprinfo.file_str), sprinfo.info_id)
+                sprinfo_start += SPRITE_SET_INFO.size
                 #write Sprites and Textures
-                temp_list = sprinfo.Sprites_list + sprinfo.Textures_list
-                if len(temp_list) > 0:
-                    for k in temp_list:
-                        f.seek(spr_start)
-                        f.write(k.id.to_bytes(4,byteorder="little"))
-                        #write str start point
-                        f.write(str_start.to_bytes(4,byteorder="little"))
-                        #wrile index
-                        f.write(k.index.to_bytes(2,byteorder="little"))
-                        #wrile info id
-                        info_id = k.info_id
-                        if not k.is_spr:
-                            #\x00\x00 mean spr
-                            #\x00\x10 mean tex
-                            info_id += 4096
-                        f.write(info_id.to_bytes(2,byteorder="little"))
-
-                        spr_start += 12
-
-                        f.seek(str_start)
-                        f.write(k.info_str.encode("UTF-8"))
-
-                        str_start = f.tell() + 1
-            file_size = f.tell()
-            print("\rCreat new mod_spr_db:100.00%")
-            print("Done!")
-            f.write(b"\x00"*(16 - (file_size%16)))
+                for k in sprinfo.Sprites_list + sprinfo.Textures_list:
+                    info_id = k.info_id if k.is_spr else k.info_id + TEXTURE_FLAG
+                    SPRITES.pack_into(data, spr_start, k.id, pool.get(k.info_str), k.index, info_id)
+                    spr_start += SPRITES.size
+                progress.update()
+            data += str_data
+            data += bytes(-len(data) % 16)
+            with open(_file_path,"wb") as f:
+                f.write(data)
+
+            progress.bytes = len(data)
+            Instrument.count("entries", progress.count)
+            Instrument.count("bytes", progress.bytes)
+            Instrument.count("strings", pool.count)
+            Instrument.count("unique_strings", len(pool.offset_dict))
+            logger.debug(f"字符串区 {len(str_data)} 字节，{pool.count} 个字符串中 {len(pool.offset_dict)} 个不重复")
+        return progress.finish()
 
     def add_spr(self,data):
-        print(f"add {data.info_str}")
+        logger.debug("add %s", data.info_str)
         if type(data) == SpriteSetInfo:
             self.sprinfo_list.append(data)
+            self.info_id.reserve(data.info_id)
             self.sprinfo_id_dict[self.sprinfo_list[-1].info_id] = self.sprinfo_list[-1]
             self.sprinfo_file_name_dict[self.sprinfo_list[-1].file_str] = self.sprinfo_list[-1].info_id
             if (self.pvtmb == None and self.sprinfo_list[-1].info_str == "SPR_SEL_PVTMB"):
@@ -136,45 +288,45 @@ class Manager:
     
     def check_index(self):
         check_list = []
+        progress = self.new_progress("Check index", len(self.sprinfo_list))
         for i in self.sprinfo_list:
-            print(f"\r\ncheck {i.info_str} index......",end="")
+            logger.debug("check %s index", i.info_str)
             check = i.check_index()
             check_list += check
-        print("\nDone!")
+            progress.update()
+        progress.finish()
         if len(check_list) > 0:
-            pprint(f"Crash Error Index:\n{check_list}")
-        else:
-            print("No Crash Error")
+            logger.warning(f"Crash Error Index:\n{pformat(check_list)}")
+        elif not self.quiet:
+            logger.info("No Crash Error")
+        return check_list
 
     def check_id(self):
+        same_sprinfo_id = self._find_same_id(self.sprinfo_list, "Check sprinfo id")
+        same_spr_id = self._find_same_id(self.spr_list, "Check Spr ID")
+        return same_sprinfo_id, same_spr_id
 
-        print("\nCheck sprinfo id")
-        id_list = []
-        same_id_list = []
-        for i in self.sprinfo_list:
-            print(f"\rcheck {i.info_str} id......",end="")
-            id_list.append(i.id)
-            if id_list.count(i.id) > 1 and same_id_list.count(i.id) == 0:
-                same_id_list.append(i.id)
-        print("Done!")
-        if len(same_id_list) > 0:
-            pprint(f"Same ID:\n{same_id_list}")
-        else:
-            print("No Same ID")
-        
-        print("\nCheck Spr ID")
-        id_list = []
+    def _find_same_id(self, data_list, name:str) -> list[int]:
+        '''
+        按首次重复出现的顺序返回重复的ID
+        '''
+        progress = self.new_progress(name, len(data_list))
+        id_set = set()
+        same_id_set = set()
         same_id_list = []
-        for i in self.spr_list:
-            print(f"\rcheck {i.info_str} id......",end="")
-            id_list.append(i.id)
-            if id_list.count(i.id) > 1 and same_id_list.count(i.id) == 0:
+        for i in data_list:
+            logger.debug("check %s id", i.info_str)
+            if i.id in id_set and i.id not in same_id_set:
+                same_id_set.add(i.id)
                 same_id_list.append(i.id)
-        print("Done!")
+            id_set.add(i.id)
+            progress.update()
+        progress.finish()
         if len(same_id_list) > 0:
-            pprint(f"Same ID:\n{same_id_list}")
-        else:
-            print("No Same ID")
+            logger.warning(f"{name} Same ID:\n{pformat(same_id_list)}")
+        elif not self.quiet:
+            logger.info(f"{name}: No Same ID")
+        return same_id_list
     
     def have_sprinfo(self, _file_name = None):
         return self.sprinfo_file_name_dict.get(_file_name)
@@ -193,35 +345,134 @@ class Manager:
                  _Sprite_Info.Textures_list.remove(data)
             self.spr_list.remove(data)
 
+    def remove_sprinfo(self, info_id:int) -> None:
+        '''
+        删除整个SpriteSetInfo及其Sprites，info_id不会再被分配
+        '''
+        sprinfo = self.sprinfo_id_dict.pop(info_id)
+        self.sprinfo_list.remove(sprinfo)
+        self.sprinfo_file_name_dict.pop(sprinfo.file_str, None)
+        self.spr_list = [spr for spr in self.spr_list if spr.info_id != info_id]
+        if self.pvtmb is sprinfo:
+            self.pvtmb = None
+
+    def merge(self, source_list:"list[Path|Manager]", override:bool = True) -> MergeReport:
+        '''
+        合并多个mod_spr_db，当前已有的数据作为第一个来源，数据库逐个读取，合并后即可释放
+        文件名相同的SpriteSetInfo只保留一个，override为True时后出现的替换先出现的内容但保留info_id
+        info_id已被占用时重新分配，Sprites的info_id随之修改
+        合并后按id建立索引，报告SpriteSetInfo与Sprites的id冲突
+        全部使用字典索引，耗时与记录总数成正比
+        '''
+        report = MergeReport(["current"] + [str(source) if isinstance(source, Path) else f"<Manager {i}>"
+                                            for i, source in enumerate(source_list)])
+        set_dict : dict[str, SpriteSetInfo] = {} # 文件名 -> 合并后的SpriteSetInfo，保持首次出现的顺序
+        source_dict : dict[str, str] = {}         # 文件名 -> 所在的数据库
+        used_info_id : set[int] = set()
+        # 合并成功后才替换当前的分配器，读取失败时保留原来的状态
+        info_id_allocator = IdAllocator(self.info_id.start)
+
+        def get_sprinfo_list():
+            yield report.source_list[0], self.sprinfo_list
+            for label, source in zip(report.source_list[1:], source_list):
+                if not isinstance(source, Manager):
+                    manager = Manager(quiet=True)
+                    manager.read_db(source)
+                    source = manager
+                yield label, source.sprinfo_list
+
+        progress = self.new_progress("Merge mod_spr_db", len(report.source_list))
+        for label, sprinfo_list in get_sprinfo_list():
+            for sprinfo in sprinfo_list:
+                kept = set_dict.get(sprinfo.file_str)
+                if kept is not None:
+                    if not override:
+                        continue
+                    info_id = kept.info_id
+                    report.override_list.append((label, sprinfo.file_str))
+                elif sprinfo.info_id in used_info_id:
+                    info_id = info_id_allocator.allocate()
+                    report.remap_list.append((label, sprinfo.file_str, sprinfo.info_id, info_id))
+                else:
+                    info_id = sprinfo.info_id
+                if info_id >= TEXTURE_FLAG:
+                    raise ValueError(f"info_id超出范围({TEXTURE_FLAG}): {sprinfo.file_str}")
+                used_info_id.add(info_id)
+                info_id_allocator.reserve(info_id)
+
+                merged = SpriteSetInfo({"id":sprinfo.id, "info_str":sprinfo.info_str,
+                                        "file_str":sprinfo.file_str, "info_id":info_id})
+                for spr in sprinfo.Sprites_list + sprinfo.Textures_list:
+                    merged.add_spr(Sprites({"id":spr.id, "info_str":spr.info_str, "index":spr.index,
+                                            "is_spr":spr.is_spr, "info_id":info_id}))
+                set_dict[sprinfo.file_str] = merged
+                source_dict[sprinfo.file_str] = label
+            progress.update()
+
+        self.info_id = info_id_allocator
+        self.sprinfo_list = []
+        self.spr_list = []
+        self.sprinfo_id_dict = {}
+        self.sprinfo_file_name_dict = {}
+        self.pvtmb = None
+        for sprinfo in set_dict.values():
+            self.add_spr(sprinfo)
+            self.spr_list += sprinfo.Sprites_list + sprinfo.Textures_list
+
+        set_index : dict[int, SpriteSetInfo] = {}
+        for sprinfo in self.sprinfo_list:
+            kept = set_index.setdefault(sprinfo.id, sprinfo)
+            if kept is not sprinfo:
+                report.set_conflict_list.append(MergeConflict(sprinfo.id, kept.info_str, kept.file_str,
+                                                              sprinfo.info_str, sprinfo.file_str,
+                                                              source_dict[sprinfo.file_str]))
+        spr_index : dict[int, Sprites] = {}
+        for spr in self.spr_list:
+            kept = spr_index.setdefault(spr.id, spr)
+            if kept is not spr:
+                kept_file = self.sprinfo_id_dict[kept.info_id].file_str
+                other_file = self.sprinfo_id_dict[spr.info_id].file_str
+                report.spr_conflict_list.append(MergeConflict(spr.id, kept.info_str, kept_file,
+                                                              spr.info_str, other_file, source_dict[other_file]))
+        progress.finish()
+
+        if report.set_conflict_list or report.spr_conflict_list:
+            logger.warning(f"Merge: {len(report.set_conflict_list)} sprinfo id conflicts, "
+                           f"{len(report.spr_conflict_list)} spr id conflicts, "
+                           f"{report.collision_count} hash collisions")
+        if not self.quiet:
+            logger.info(f"Merge: {len(self.sprinfo_list)} sprinfo, {len(self.spr_list)} spr from "
+                        f"{len(report.source_list)} sources, {len(report.remap_list)} info_id remapped, "
+                        f"{len(report.override_list)} overridden")
+        return report
+
 class SpriteSetInfo:
-    max_info_id = -1
-    def __init__(self,data,file = None):
-        self.Sprites_list = list()
-        self.Textures_list = list()
-        self.spr_dict = {}
-        if type(data) == type(dict()):
-            self.id = data["id"]
-            self.info_str = data["info_str"]
-            self.file_str = data["file_str"]
-            self.info_id = data["info_id"]
-        elif file != None:
-            self.id = self.to_int(data[:4])
-            self.info_str = self.get_str(file, self.to_int(data[4:8]))
-            self.file_str = self.get_str(file, self.to_int(data[8:12]))
-            self.info_id = self.to_int(data[12:16])
-    
-    def get_str(self, file, start):
-        file.seek(start)
-        get_str = ""
-        get_char = ""
-        while get_char != b"\x00":
-            if get_char != "":
-                get_str += get_char.decode("utf-8")
-            get_char = file.read(1)
-        return get_str
+    '''
+    使用__slots__，合并大量数据库时每条记录不再附带__dict__
+    '''
+    __slots__ = ("id", "info_str", "file_str", "info_id", "Sprites_list", "Textures_list")
+
+    def __init__(self, data:dict):
+        self.id:int = data["id"]
+        self.info_str:str = data["info_str"]
+        self.file_str:str = data["file_str"]
+        self.info_id:int = data["info_id"]
+        self.Sprites_list:list[Sprites] = []
+        self.Textures_list:list[Sprites] = []
 
-    def to_int(self,int_byte):
-        return int.from_bytes(int_byte,"little")
+    @classmethod
+    def from_record(cls, record:tuple[int,int,int,int], data:bytes) -> "SpriteSetInfo":
+        '''
+        record为SPRITE_SET_INFO解析出的数据，data为整个文件
+        '''
+        self = cls.__new__(cls)
+        self.id = record[0]
+        self.info_str = get_str(data, record[1])
+        self.file_str = get_str(data, record[2])
+        self.info_id = record[3]
+        self.Sprites_list = []
+        self.Textures_list = []
+        return self
     
     def add_spr(self, data):
         if data.is_spr == True:
@@ -242,52 +493,39 @@ class SpriteSetInfo:
         return wrong_list
     
 class Sprites:
-    def __init__(self,data,file = None):
-        if type(data) == type(dict()):
-            self.id = data["id"]
-            self.info_str = data["info_str"]
-            self.index = data["index"]
-            self.is_spr = data["is_spr"]
-            self.info_id = data["info_id"]
-        elif file != None:
-            self.id = self.to_int(data[:4])
-            self.info_str = self.get_str(file, self.to_int(data[4:8]))
-            self.index = int.from_bytes(data[8:10],"little")
-            self.get_info_id(data[10:12])
-    
-    def get_str(self, file, start):
-        file.seek(start)
-        get_str = ""
-        get_char = ""
-        while get_char != b"\x00":
-            if get_char != "":
-                get_str += get_char.decode("utf-8")
-            get_char = file.read(1)
-        return get_str
+    __slots__ = ("id", "info_str", "index", "is_spr", "info_id")
 
-    def to_int(self,int_byte):
-        return int.from_bytes(int_byte,"little")
-    
-    def get_info_id(self,data):
-        check = data[1]
-        if check >= 16:
-            self.is_spr = False
-            check -= 16
-        else:
-            self.is_spr = True
-        self.info_id = data[0] + (check * 256)
+    def __init__(self, data:dict):
+        self.id:int = data["id"]
+        self.info_str:str = data["info_str"]
+        self.index:int = data["index"]
+        self.is_spr:bool = data["is_spr"]
+        self.info_id:int = data["info_id"]
+
+    @classmethod
+    def from_record(cls, record:tuple[int,int,int,int], data:bytes) -> "Sprites":
+        '''
+        info_id大于等于0x1000的是贴图
+        '''
+        self = cls.__new__(cls)
+        self.id = record[0]
+        self.info_str = get_str(data, record[1])
+        self.index = record[2]
+        self.is_spr = record[3] < TEXTURE_FLAG
+        self.info_id = record[3] if self.is_spr else record[3] - TEXTURE_FLAG
+        return self
 
 class add_farc_to_Manager:
     def __init__(self, _farc, _Manager):
-        print(f"\n*Start add {_farc.name} to mod_spr_db*")
+        logger.debug(f"Start add {_farc.name} to mod_spr_db")
         self.Manager = _Manager
         self.farc_file = BytesIO(_farc.data)
         self.farc_name = _farc.name
-        info_id = self.creat_sprsetinfo()
+        self.info_id = self.creat_sprsetinfo()
         spr_list = self.get_info("spr")
         tex_list = self.get_info("tex")
-        self.creat_sprinfo(spr_list, _is_spr = True, _info_id = info_id)
-        self.creat_sprinfo(tex_list, _is_spr = False, _info_id = info_id)
+        self.creat_sprinfo(spr_list, _is_spr = True, _info_id = self.info_id)
+        self.creat_sprinfo(tex_list, _is_spr = False, _info_id = self.info_id)
 
     def get_info(self, _type = None):
         _file = self.farc_file
@@ -324,24 +562,25 @@ class add_farc_to_Manager:
     def creat_sprsetinfo(self):
         if self.Manager.have_sprinfo(self.farc_name) == None:
             head_str = self.farc_name[:-4].upper()
-            SpriteSetInfo.max_info_id  += 1
-            info_id = SpriteSetInfo.max_info_id
+            info_id = self.Manager.info_id.allocate()
             sprsetinfo_dict = {"id":0,
                             "info_str":head_str,
                             "file_str":self.farc_name,
                             "info_id":info_id
                             }
             sprsetinfo_dict["id"] = get_hash(head_str) if (head_str != "SPR_SEL_PVTMB") else 4527
-            print(head_str)
+            logger.debug(head_str)
             self.Manager.add_spr(SpriteSetInfo(sprsetinfo_dict))
             
         else:
-            print(f"\n**Try to add {self.farc_name} but it's already have,it's will be rewrite**\n")
+            logger.warning(f"Try to add {self.farc_name} but it's already have,it's will be rewrite")
             info_id = self.Manager.have_sprinfo(self.farc_name)
             self.Manager.Remove_Sprites(self.Manager.sprinfo_id_dict[info_id])
         return info_id
 
-    def creat_sprinfo(self, head_str_list , _is_spr=True, _info_id = SpriteSetInfo.max_info_id):
+    def creat_sprinfo(self, head_str_list , _is_spr=True, _info_id = None):
+        if _info_id == None:
+            _info_id = self.info_id
         sprinfo_dict = {"id":0,
                         "info_str":0,
                         "index":0,
@@ -369,7 +608,8 @@ class read_farc:
             lenght = int.from_bytes(f.read(4),byteorder="big")
             f.seek(12)
             file_info = self.get_file_list(f, lenght)
-            f.seek(lenght,1)
+            # 文件名与数据地址之后紧接压缩后大小与原始大小
+            f.seek(lenght)
             file_info["SizeComp"] = self.fix_file_size(f, int.from_bytes(f.read(4),byteorder="big"), file_info["start_point"])
             file_info["Size"] = int.from_bytes(f.read(4),byteorder="big")
             file_info["data"] = self.unpack_farc(file_info, f)
@@ -418,3 +658,125 @@ class read_farc:
         data = _file.read(_file_info["SizeComp"])
         return zlib.decompress(data, wbits=16+zlib.MAX_WBITS, bufsize=_file_info["Size"])
 
+
+'''
+增量更新mod_spr_db
+在数据库旁保存每个farc的 大小+修改时间（可选内容哈希），只重新读取变化的farc
+已有的info_id保持不变，新的farc使用新的info_id，删除的farc不再占用但其info_id也不会被复用
+'''
+
+STATE_VERSION = 1
+
+@dataclass
+class FarcStamp:
+    size : int
+    mtime_ns : int
+    file_str : str # farc内的文件名，对应SpriteSetInfo.file_str
+    hash : str|None = None
+
+@dataclass
+class UpdateResult:
+    added : list[str] = field(default_factory=list)
+    updated : list[str] = field(default_factory=list)
+    removed : list[str] = field(default_factory=list)
+    skipped : list[str] = field(default_factory=list)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.updated or self.removed)
+
+def get_state_path(db_path:Path) -> Path:
+    return db_path.with_name(f"{db_path.stem}_state.json")
+
+def get_farc_hash(farc_path:Path) -> str:
+    with open(farc_path, "rb") as f:
+        return hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+
+def load_state(state_path:Path) -> dict[str, FarcStamp]:
+    '''
+    文件不存在、版本不一致或内容无法解析时返回空字典，所有farc都会重新读取
+    '''
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"无法读取 {state_path}: {e}")
+        return {}
+    try:
+        if state.get("version") != STATE_VERSION:
+            return {}
+        return {name:FarcStamp(**stamp) for name, stamp in state["farc"].items()}
+    except (AttributeError, TypeError, KeyError) as e:
+        logger.warning(f"状态文件格式错误 {state_path}: {e}")
+        return {}
+
+def save_state(state_path:Path, stamp_dict:dict[str, FarcStamp]) -> None:
+    temp_path = state_path.with_suffix(".tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"version":STATE_VERSION,
+                   "farc":{name:asdict(stamp) for name, stamp in stamp_dict.items()}},
+                  f, ensure_ascii=False, indent=1)
+    os.replace(temp_path, state_path)
+
+def update_db(db_path:Path, farc_list:list[Path], state_path:Path|None = None,
+              use_hash:bool = False, manager:Manager|None = None) -> UpdateResult:
+    '''
+    读取已有的db_path，与farc_list比较后只重新读取变化的farc
+    大小或修改时间变化但use_hash为True且内容哈希一致时也视为未变化
+    不在记录中的SpriteSetInfo（如手动添加的）保持不变
+    没有任何变化且数据库已存在时不重新写入
+    '''
+    state_path = state_path or get_state_path(db_path)
+    manager = manager or Manager()
+    if db_path.exists():
+        manager.read_db(db_path)
+    old_state = load_state(state_path)
+    new_state : dict[str, FarcStamp] = {}
+    result = UpdateResult()
+
+    progress = manager.new_progress("Update mod_spr_db", len(farc_list))
+    for farc_path in farc_list:
+        progress.update()
+        stat = farc_path.stat()
+        stamp = old_state.get(farc_path.name)
+        is_in_db = stamp is not None and manager.have_sprinfo(stamp.file_str) is not None
+        if is_in_db and stamp.size == stat.st_size and stamp.mtime_ns == stat.st_mtime_ns:
+            new_state[farc_path.name] = stamp
+            result.skipped.append(farc_path.name)
+            continue
+
+        farc_hash = get_farc_hash(farc_path) if use_hash else None
+        if is_in_db and farc_hash is not None and stamp.hash == farc_hash:
+            new_state[farc_path.name] = FarcStamp(stat.st_size, stat.st_mtime_ns, stamp.file_str, farc_hash)
+            result.skipped.append(farc_path.name)
+            continue
+
+        farc = read_farc(farc_path)
+        # 已存在的SpriteSetInfo由add_farc_to_Manager替换，保留原来的info_id
+        if manager.have_sprinfo(farc.name) is None:
+            result.added.append(farc_path.name)
+        else:
+            result.updated.append(farc_path.name)
+        add_farc_to_Manager(farc, manager)
+        new_state[farc_path.name] = FarcStamp(stat.st_size, stat.st_mtime_ns, farc.name, farc_hash)
+
+    # 改名后的farc内部的bin名称不变时，SpriteSetInfo仍属于新的farc，不能删除
+    live_file_set = {stamp.file_str for stamp in new_state.values()}
+    for name, stamp in old_state.items():
+        if name in new_state:
+            continue
+        info_id = manager.have_sprinfo(stamp.file_str)
+        if info_id is not None and stamp.file_str not in live_file_set:
+            manager.remove_sprinfo(info_id)
+        result.removed.append(name)
+    progress.finish()
+
+    if result.changed or not db_path.exists():
+        manager.write_db(db_path)
+    save_state(state_path, new_state)
+    if not manager.quiet:
+        logger.info(f"mod_spr_db: {len(result.added)} added, {len(result.updated)} updated, "
+                    f"{len(result.removed)} removed, {len(result.skipped)} unchanged")
+    return result
@@ -0,0 +1,133 @@
+from lib.CsfmReader import read_csfm
+from lib.ConvertDSC import DSCManager
+from lib.CsfmWriter import SyntheticChartSetting, generate_csfm_data, write_csfm
+from dataclasses import asdict
+from pathlib import Path
+from collections.abc import Callable
+import argparse
+import tempfile
+import logging
+import json
+import time
+import sys
+
+logger = logging.getLogger('benchmark')
+
+'''
+使用随机生成的谱面测试转换流程各阶段的速度
+parse  : read_csfm
+timing : TickManager.tick_to_time
+encode : DSCManager.get_dsc_dict
+write  : DSCManager.creat_dsc_file
+'''
+
+def init_logging():
+    logging.basicConfig(
+        format='{asctime} {levelname} [{name}]: {message}',
+        style='{',
+        level=logging.INFO,
+        handlers=[logging.StreamHandler()],
+    )
+    # 读取时的逐文件日志会影响计时
+    logging.getLogger('CsfmReader').setLevel(logging.WARNING)
+
+def measure(func:Callable[[], object], repeat:int, setup:Callable[[], object]|None = None) -> list[float]:
+    '''
+    执行repeat次并返回每次的耗时，setup的耗时不计入
+    '''
+    time_list = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start_time = time.perf_counter()
+        func()
+        time_list.append(time.perf_counter() - start_time)
+    return time_list
+
+def run_timing(dsc_manager:DSCManager) -> None:
+    chart_offset_dsc = int(dsc_manager.chart_offset * 1000 * 100)
+    for count, (tick, _) in enumerate(dsc_manager.note_mananger.get_group()):
+        dsc_manager.tick_manager.tick_to_time(tick, chart_offset_dsc, count)
+
+def run_benchmark(setting:SyntheticChartSetting, repeat:int, work_path:Path) -> dict:
+    csfm_path = work_path.joinpath(f"bench_{setting.seed}.csfm")
+    file_size = write_csfm(csfm_path, generate_csfm_data(setting))
+    csfm_data = read_csfm(csfm_path)
+    dsc_manager = DSCManager()
+    def reset_chart() -> None:
+        dsc_manager.read_csfm_data(csfm_data)
+
+    dsc_path = work_path.joinpath("pv_0_extreme.dsc")
+    stage_dict = {
+        "parse": measure(lambda: read_csfm(csfm_path), repeat),
+        "timing": measure(lambda: run_timing(dsc_manager), repeat, reset_chart),
+        "encode": measure(dsc_manager.get_dsc_dict, repeat, reset_chart),
+        "write": measure(lambda: dsc_manager.creat_dsc_file(0, work_path), repeat, reset_chart),
+    }
+    byte_dict = {"parse":file_size, "write":dsc_path.stat().st_size}
+
+    result = {}
+    for name, time_list in stage_dict.items():
+        best = min(time_list)
+        result[name] = {
+            "best":best,
+            "mean":sum(time_list) / len(time_list),
+            "targets_per_sec":setting.target_count / best if best > 0 else 0.0,
+            "bytes_per_sec":byte_dict.get(name, 0) / best if best > 0 else 0.0,
+        }
+    return result
+
+def compare_baseline(result:dict, baseline:dict, tolerance:float) -> bool:
+    '''
+    与基准对比best耗时，超出tolerance比例视为性能退化
+    '''
+    is_ok = True
+    for name, stage in result["stages"].items():
+        if name not in baseline["stages"]:
+            continue
+        ratio = stage["best"] / baseline["stages"][name]["best"]
+        if ratio > 1 + tolerance:
+            is_ok = False
+            logger.warning(f"{name}: {ratio:.2f}x of baseline (regression)")
+        else:
+            logger.info(f"{name}: {ratio:.2f}x of baseline")
+    return is_ok
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--targets", type=int, default=5000)
+    parser.add_argument("--tempo", type=int, default=32, help="BPM点数量")
+    parser.add_argument("--events", type=int, default=16)
+    parser.add_argument("--strings", type=int, default=0, help="额外加入字符串池的字符串数量")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", type=Path, default=None, help="对比的基准json")
+    parser.add_argument("--save", type=Path, default=None, help="将结果保存为json")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    init_logging()
+    args = get_args()
+    setting = SyntheticChartSetting(seed=args.seed, target_count=args.targets, tempo_count=args.tempo,
+                                    event_count=args.events, string_count=args.strings)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        result = {"setting":asdict(setting), "repeat":args.repeat,
+                  "stages":run_benchmark(setting, args.repeat, Path(work_dir))}
+
+    for name, stage in result["stages"].items():
+        logger.info(f"{name}: best {stage['best'] * 1000:.2f}ms, mean {stage['mean'] * 1000:.2f}ms, "
+                    f"{stage['targets_per_sec']:.0f} targets/s, {stage['bytes_per_sec'] / 1024 / 1024:.2f} MiB/s")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["setting"] != result["setting"]:
+            logger.warning("基准与当前的谱面参数不一致，对比结果仅供参考")
+        if not compare_baseline(result, baseline, args.tolerance):
+            sys.exit(1)
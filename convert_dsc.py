@@ -0,0 +1,60 @@
+from lib.CsfmReader import read_csfm
+from lib.ConvertDSC import DSCManager
+from pathlib import Path
+import argparse
+import logging
+import re
+import sys
+
+logger = logging.getLogger('convert_dsc')
+
+'''
+只把csfm转换为dsc
+不导入FarcCreater，因此不会加载kkdlib与PIL，适合编辑器频繁调用
+'''
+
+def init_logging(quiet:bool):
+    logging.basicConfig(
+        format='{asctime} {levelname} [{name}]: {message}',
+        style='{',
+        level=logging.WARNING if quiet else logging.INFO,
+        handlers=[logging.StreamHandler()],
+    )
+
+def get_pv_id(csfm_path:Path, pv_id:int|None) -> int:
+    '''
+    未指定pv_id时使用所在文件夹的名称
+    '''
+    if pv_id is not None:
+        return pv_id
+    if not re.match(r"\d+$", csfm_path.parent.name):
+        raise ValueError(f"无法从文件夹名称获取pv_id，请使用--pv-id指定: {csfm_path}")
+    return int(csfm_path.parent.name)
+
+def convert(csfm_path:Path, output_path:Path, pv_id:int|None = None, dsc_manager:DSCManager|None = None) -> None:
+    dsc_manager = dsc_manager or DSCManager()
+    dsc_manager.read_csfm_data(read_csfm(csfm_path))
+    dsc_manager.creat_dsc_file(get_pv_id(csfm_path, pv_id), output_path)
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("csfm", type=Path, nargs="+")
+    parser.add_argument("--output", type=Path, default=Path("."), help="dsc输出目录")
+    parser.add_argument("--pv-id", type=int, default=None)
+    parser.add_argument("--quiet", action="store_true")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = get_args()
+    init_logging(args.quiet)
+    args.output.mkdir(parents=True, exist_ok=True)
+    dsc_manager = DSCManager()
+    is_ok = True
+    for csfm_path in args.csfm:
+        try:
+            convert(csfm_path, args.output, args.pv_id, dsc_manager)
+        except (OSError, ValueError) as e:
+            logger.error(f"{csfm_path}: {e}")
+            is_ok = False
+    if not is_ok:
+        sys.exit(1)
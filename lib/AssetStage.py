@@ -0,0 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+import shutil
+import time
+import sys
+import os
+
+import logging
+
+logger = logging.getLogger('AssetStage')
+
+'''
+歌曲与视频等大文件的复制
+在后台线程中执行，不会阻塞谱面转换与贴图编码
+目标文件的大小与修改时间都与源文件一致时跳过
+'''
+
+# linux的FICLONE ioctl，用于btrfs/xfs等文件系统的写时复制
+_FICLONE = 0x40049409
+
+class LinkMode(Enum):
+    COPY     = "copy"     # 总是复制
+    REFLINK  = "reflink"  # 优先使用写时复制，不支持时复制
+    HARDLINK = "hardlink" # 优先使用硬链接，不在同一文件系统时复制
+
+@dataclass
+class AssetResult:
+    src : Path
+    dst : Path
+    method : str # skip, reflink, hardlink, copy
+    size : int
+    elapsed : float
+    pv_id : int|None = None
+
+def is_same_file(src_stat:os.stat_result, dst:Path) -> bool:
+    try:
+        dst_stat = dst.stat()
+    except FileNotFoundError:
+        return False
+    return dst_stat.st_size == src_stat.st_size and dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+
+def _reflink(src:Path, dst:Path) -> None:
+    if not sys.platform.startswith("linux"):
+        raise OSError("当前系统不支持reflink")
+    import fcntl
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+    shutil.copystat(src, dst)
+
+def _hardlink(src:Path, dst:Path) -> None:
+    dst.unlink(missing_ok=True)
+    os.link(src, dst)
+
+def stage_file(src:Path, dst:Path, link_mode:LinkMode = LinkMode.REFLINK) -> tuple[str, int]:
+    '''
+    返回 (使用的方式, 文件大小)
+    '''
+    src_stat = src.stat()
+    if is_same_file(src_stat, dst):
+        return "skip", src_stat.st_size
+
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    link_func = {LinkMode.REFLINK:_reflink, LinkMode.HARDLINK:_hardlink}.get(link_mode)
+    if link_func:
+        try:
+            link_func(src, dst)
+            return link_mode.value, src_stat.st_size
+        except OSError as e:
+            logger.debug(f"{link_mode.value}失败，改为复制 {src}: {e}")
+    shutil.copy2(src, dst)
+    return "copy", src_stat.st_size
+
+class AssetStager:
+    '''
+    后台复制队列
+    submit立即返回，wait等待全部完成并返回结果与失败的文件
+    '''
+    def __init__(self, link_mode:LinkMode = LinkMode.REFLINK, max_workers:int = 4) -> None:
+        self.link_mode = link_mode
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="AssetStage")
+        self.future_list : list[tuple[Path, Future[AssetResult]]] = []
+
+    def __enter__(self) -> "AssetStager":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+    def __stage(self, src:Path, dst:Path, pv_id:int|None) -> AssetResult:
+        start_time = time.perf_counter()
+        method, size = stage_file(src, dst, self.link_mode)
+        logger.debug(f"{method} {src} -> {dst}")
+        return AssetResult(src, dst, method, size, time.perf_counter() - start_time, pv_id)
+
+    def submit(self, src:Path, dst:Path, pv_id:int|None = None) -> Future[AssetResult]:
+        future = self.executor.submit(self.__stage, src, dst, pv_id)
+        self.future_list.append((src, future))
+        return future
+
+    def wait(self) -> tuple[list[AssetResult], list[tuple[Path, BaseException]]]:
+        result_list : list[AssetResult] = []
+        error_list : list[tuple[Path, BaseException]] = []
+        for src, future in self.future_list:
+            try:
+                result_list.append(future.result())
+            except Exception as e:
+                logger.error(f"无法复制 {src}: {e}")
+                error_list.append((src, e))
+        self.future_list.clear()
+        return result_list, error_list
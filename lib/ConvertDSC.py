@@ -1,25 +1,85 @@
 
-from .CsfmDataClass import BPM,Note,DSCCommandID,Difficulty
+from .CsfmDataClass import BPM,Note,NoteF2X,LinkRole,ComfyNoteID,DSCCommandID,Difficulty
+from . import Instrument
 from pathlib import Path
 from collections import defaultdict
 from pprint import pprint
 import struct
+from bisect import bisect_left
+from itertools import groupby
 from collections.abc import Generator
+from dataclasses import replace
+from itertools import repeat
+
+import logging
+
+logger = logging.getLogger('ConvertDSC')
 
 DSC_HEAD = b"\x21\x09\x05\x14"
 
+F2X_FLAG_KEYS = ("Long", "Double", "Rush", "Link")
+
+def is_f2x_chart(data_dict : dict) -> bool:
+    '''
+    使用了F2X专有的Note时按F2X谱面转换，否则保持FT的转换结果不变
+    '''
+    return any(True in data_dict.get(key, ()) for key in F2X_FLAG_KEYS) \
+           or ComfyNoteID.STAR in data_dict.get("Type", ())
+
+def resolve_link(next_id_list, previous_id_list, link_list) -> tuple[list[LinkRole], list[tuple[int,int]]]:
+    '''
+    NextID与PreviousID为Note在文件中的序号，-1表示没有
+    只用两个序号数组计算每个Note在连接中的位置，整体为O(N)
+    返回 (每个Note的LinkRole, 每条连接的(起点, 终点))
+    成环或不完整的连接按普通Note处理
+    '''
+    count = len(link_list)
+    next_list = [index if 0 <= index < count else -1 for index in next_id_list]
+    previous_list = [index if 0 <= index < count else -1 for index in previous_id_list]
+    # 只记录了一侧时补全另一侧
+    for index in range(count):
+        if next_list[index] != -1 and previous_list[next_list[index]] == -1:
+            previous_list[next_list[index]] = index
+        if previous_list[index] != -1 and next_list[previous_list[index]] == -1:
+            next_list[previous_list[index]] = index
+
+    role_list = [LinkRole.NONE] * count
+    span_list : list[tuple[int,int]] = []
+    for head in range(count):
+        if not link_list[head] or previous_list[head] != -1 or next_list[head] == -1:
+            continue
+        # 每个Note最多被访问一次
+        index = head
+        while next_list[index] != -1 and role_list[next_list[index]] == LinkRole.NONE and next_list[index] != head:
+            role_list[index] = LinkRole.MIDDLE
+            index = next_list[index]
+        # 下一个Note已属于其他连接，只剩起点时不构成连接
+        if index == head:
+            continue
+        role_list[head] = LinkRole.HEAD
+        role_list[index] = LinkRole.TAIL
+        span_list.append((head, index))
+
+    unresolved = sum(1 for index in range(count)
+                     if link_list[index] and role_list[index] == LinkRole.NONE and
+                     (next_list[index] != -1 or previous_list[index] != -1))
+    if unresolved:
+        logger.warning(f"{unresolved} 个Note的连接无法解析，按普通Note处理")
+    return role_list, span_list
+
 class NoteManager:
     def __init__(self) -> None:
         '''
-        使用列表储存Note数据
-        利用列表pop（末端取出）效率更快的特性颠倒了列表
+        使用列表储存按tick稳定排序后的Note数据
+        group_list记录每个tick对应的 (tick, 切片)，读取时建立一次
         时间具体时间仍然由TickManager处理
         '''
         self.data_list : list[Note] = []
-        self.data : tuple[Note]
+        self.group_list : list[tuple[int, slice]] = []
 
-    def check_last_data(self, tick : int) -> bool:
-        return len(self.data_list) > 0 and self.data_list[-1].tick == tick
+    def clear(self) -> None:
+        self.data_list.clear()
+        self.group_list.clear()
 
     def read_note(self, data_dict : dict) -> None:
         data_zip : zip = zip(data_dict["Tick"],
@@ -28,23 +88,55 @@ class NoteManager:
                              data_dict["Hold"],data_dict["Chain"],data_dict["Chance"],
                              data_dict["Position"],data_dict["Angle"],
                              data_dict["Frequency"],data_dict["Amplitude"],data_dict["Distance"])
-        self.data_list.clear()
+        if is_f2x_chart(data_dict):
+            note_list = self.read_f2x_note(data_dict)
+        else:
+            note_list = [Note(*data_tuple) for data_tuple in data_zip]
+        # 稳定排序，同一tick的Note保持文件中的顺序，输入已排序时几乎没有开销
+        order = sorted(range(len(note_list)), key=lambda index: note_list[index].tick)
+        self.data_list = [note_list[index] for index in order]
+        self.build_group()
+
+    def read_f2x_note(self, data_dict : dict) -> list[NoteF2X]:
+        count = len(data_dict["Tick"])
+        def column(key:str, default):
+            '''
+            FT格式的csfm没有F2X的列，使用默认值
+            '''
+            return data_dict[key] if key in data_dict else repeat(default, count)
+        role_list, _ = resolve_link(column("NextID", -1), column("PreviousID", -1), tuple(column("Link", False)))
+        data_zip : zip = zip(data_dict["Tick"],
+                             data_dict["Type"],
+                             data_dict["Properties"],
+                             data_dict["Hold"],data_dict["Chain"],data_dict["Chance"],
+                             data_dict["Position"],data_dict["Angle"],
+                             data_dict["Frequency"],data_dict["Amplitude"],data_dict["Distance"],
+                             column("Long", False),column("Double", False),column("Rush", False),column("Link", False),
+                             column("EndTick", -1),column("ReferenceID", -1),
+                             column("PreviousID", -1),column("NextID", -1),
+                             role_list)
+        note_list = []
         for data_tuple in data_zip:
-            self.data_list.append(Note(*data_tuple))
-        self.data_list.reverse()
+            note = NoteF2X(*data_tuple)
+            note_list.append(note)
+            if note.islong and note.end_tick > note.tick:
+                note_list.append(replace(note, tick=note.end_tick, isproperties=True))
+        return note_list
+
+    def build_group(self) -> None:
+        self.group_list = []
+        start = 0
+        for tick, group in groupby(note.tick for note in self.data_list):
+            end = start + sum(1 for _ in group)
+            self.group_list.append((tick, slice(start, end)))
+            start = end
+
+    def get_group(self) -> Generator[tuple[int, slice], None, None]:
+        yield from self.group_list
 
     def get_note(self) -> Generator[tuple[Note], None, None]:
-        while len(self.data_list) > 0:
-            yield self.get_last_note()
-    
-    def get_last_note(self) -> tuple[Note]:
-        last_note_list = []
-        tick = self.data_list[-1].tick
-        while self.check_last_data(tick):
-            note_data = self.data_list.pop()
-            last_note_list.append(note_data)
-        self.data = tuple(last_note_list)
-        return self.data
+        for _, note_slice in self.group_list:
+            yield tuple(self.data_list[note_slice])
 
 class BPMManager:
     """
@@ -55,19 +147,26 @@ class BPMManager:
     """
     def __init__(self) -> None:
         self.data_list : list[BPM] = []
+        self.source : tuple|None = None
 
     def check_last_data(self, tick : int) -> bool:
         return len(self.data_list) > 0 and self.data_list[-1].tick <= tick
 
-    def read_bpm(self, data_dict : dict) -> None:
-        data_zip : zip = zip(data_dict["Tick"],
-                             data_dict["Tempo"],
-                             data_dict["Flying Time Factor"])
-        self.data_list.clear()
-        for data_tuple in data_zip:
-            self.data_list.append(BPM(*data_tuple))
+    def read_bpm(self, data_dict : dict) -> bool:
+        '''
+        Tempo Map与上一次读取的相同时直接复用，返回是否重新生成
+        重新生成时会替换data_list对象，TickManager据此判断是否需要重建变速表
+        '''
+        source = (tuple(data_dict["Tick"]),
+                  tuple(data_dict["Tempo"]),
+                  tuple(data_dict["Flying Time Factor"]))
+        if source == self.source:
+            return False
+        self.source = source
+        self.data_list = [BPM(*data_tuple) for data_tuple in zip(*source)]
         # 保证 BPM 点按 tick 升序排列，便于后续计算
         self.data_list.sort(key=lambda bpm: bpm.tick)
+        return True
 
 class TickManager:
     '''
@@ -78,18 +177,27 @@ class TickManager:
     def __init__(self, _manager:BPMManager) -> None:
         self.bpm_manager:BPMManager = _manager
         self.target_flying_time:int = -1
-        
-    def tick_to_time(self, tick:int, offset, count) -> tuple[dict[int,bytes], int]:
-        """
-        计算给定 tick 对应的时间与飞入时间。
-        规则：
-        - 每个 BPM 点在其所在 tick 处开始一段最长 192 tick 的线性变速（飞入时间线性插值）；
-        - 如果在 192 tick 内又出现新的 BPM，则在新 BPM 处
-          以“当前瞬时飞入时间”为起点，重新开始一段新的 192 tick 线性变速，保证平滑连续。
-        """
+        # 变速表，对应的BPM列表变化时重新生成
+        self.table_source:list[BPM]|None = None
+        self.change_tick_list:list[int] = []
+        self.state_list:list[tuple[BPM,BPM,float]] = []
+
+    def reset(self) -> None:
+        self.target_flying_time = -1
+
+    def build_tempo_table(self) -> None:
+        '''
+        预先计算经过每个BPM点后的 (cur_bpm, pre_bpm, last_change_time)
+        change_tick_list记录会产生变化的BPM点的tick，tick_to_time中二分查找
+        计算顺序与逐个遍历完全一致，保证结果不变
+        '''
         if not self.bpm_manager.data_list:
             raise ValueError("没有读取到BPM表")
-        
+
+        self.table_source = self.bpm_manager.data_list
+        self.change_tick_list = []
+        self.state_list = []
+
         cur_bpm:BPM = BPM()
         pre_bpm:BPM = BPM()
         last_change_time:float = 0.0
@@ -103,9 +211,8 @@ class TickManager:
                 # 出现了新的bpm但没有产生变化，跳过
                 continue
             else:
-                if bpm.tick >= tick:
-                    # 当前note在新bpm前面，跳出循环
-                    break
+                # 当前note在新bpm前面时会在这里停下
+                self.change_tick_list.append(bpm.tick)
                 
                 # 检查pre是否已执行完变速
                 pre_change_tick = bpm.tick - pre_bpm.tick
@@ -119,7 +226,22 @@ class TickManager:
                 cur_bpm = bpm
             
             last_change_time += pre_bpm.tick_time * (cur_bpm.tick - pre_bpm.tick) if cur_bpm.tick != 0 else cur_bpm.tick_time * (cur_bpm.tick - pre_bpm.tick)
-    
+            self.state_list.append((cur_bpm, pre_bpm, last_change_time))
+        
+    def tick_to_time(self, tick:int, offset, count) -> tuple[dict[int,bytes], int]:
+        """
+        计算给定 tick 对应的时间与飞入时间。
+        规则：
+        - 每个 BPM 点在其所在 tick 处开始一段最长 192 tick 的线性变速（飞入时间线性插值）；
+        - 如果在 192 tick 内又出现新的 BPM，则在新 BPM 处
+          以“当前瞬时飞入时间”为起点，重新开始一段新的 192 tick 线性变速，保证平滑连续。
+        """
+        if self.table_source is not self.bpm_manager.data_list:
+            self.build_tempo_table()
+
+        # 第一个tick不小于当前note的BPM点之前的状态
+        cur_bpm, pre_bpm, last_change_time = self.state_list[bisect_left(self.change_tick_list, tick)]
+
         after_change_tick = tick - cur_bpm.tick
         if after_change_tick > 192:
             """
@@ -154,6 +276,27 @@ class TickManager:
             dsc_dict[time] = struct.pack("<ii",DSCCommandID.TARGET_FLYING_TIME,flying_time)
         return dsc_dict
 
+def read_dsc_command(dsc_data: bytes, dsc_head: bytes = DSC_HEAD) -> list[tuple[int,int,tuple[int,...]]]:
+    '''
+    将dsc解析为 (时间, 指令, 参数) 列表
+    时间为之前最后一个TIME指令的值，TIME指令本身不放入列表
+    '''
+    if not dsc_data.startswith(dsc_head):
+        raise ValueError("dsc文件头错误")
+    command_list = []
+    time = -1
+    offset = len(dsc_head)
+    while offset < len(dsc_data):
+        command_id = DSCCommandID(struct.unpack_from("<i", dsc_data, offset)[0])
+        param_count = command_id.get_param_count()
+        param = struct.unpack_from(f"<{param_count}i", dsc_data, offset + 4)
+        offset += 4 + param_count * 4
+        if command_id is DSCCommandID.TIME:
+            time = param[0]
+        else:
+            command_list.append((time, int(command_id), param))
+    return command_list
+
 class DSCManager:
 
     def __init__(self) -> None:
@@ -169,28 +312,51 @@ class DSCManager:
 
         self.command_time_dict : dict[str,float] ={}
 
+    def reset(self) -> None:
+        '''
+        清除上一个难度遗留的状态
+        BPM表与变速表保留，下一个难度的Tempo Map相同时直接复用
+        '''
+        self.difficulty_str = "unknow"
+        self.chart_offset = 0.0
+        self.have_movie = False
+        self.have_song = False
+        self.command_time_dict.clear()
+        self.note_mananger.clear()
+        self.tick_manager.reset()
+
     def read_csfm_data(self, csfm_data: dict) -> None:
-        chart_data_dict = csfm_data["Chart"]
-        # 检查文件是否存在，不存在的文件将offset设置为0
-        self.have_movie = csfm_data["Metadata"]["Movie File Name"] and csfm_data["Metadata"]["Movie File Name"].exists()
-        self.have_song = csfm_data["Metadata"]["Song File Name"] and csfm_data["Metadata"]["Song File Name"].exists()
-
-        self.bpm_manager.read_bpm(chart_data_dict["Tempo Map"])
-        self.note_mananger.read_note(chart_data_dict["Targets"])
-        self.__updata_time_var_dict(chart_data_dict["Time"])
-        self.__updata_difficulty_str(chart_data_dict["Difficulty"])
+        with Instrument.stage("read_csfm_data"):
+            self.reset()
+            chart_data_dict = csfm_data["Chart"]
+            # 检查文件是否存在，不存在的文件将offset设置为0
+            self.have_movie = csfm_data["Metadata"]["Movie File Name"] and csfm_data["Metadata"]["Movie File Name"].exists()
+            self.have_song = csfm_data["Metadata"]["Song File Name"] and csfm_data["Metadata"]["Song File Name"].exists()
+
+            self.bpm_manager.read_bpm(chart_data_dict["Tempo Map"])
+            self.note_mananger.read_note(chart_data_dict["Targets"])
+            self.__updata_time_var_dict(chart_data_dict["Time"])
+            self.__updata_difficulty_str(chart_data_dict["Difficulty"])
+
+            Instrument.count("bpm_points", len(self.bpm_manager.data_list))
+            Instrument.count("notes", len(self.note_mananger.data_list))
     
     def creat_dsc_file(self, pv_id: int, export_path:Path, dsc_head: bytes = DSC_HEAD) -> None:
         DSC_FILE_NAME = "_".join(("pv", str(pv_id), self.difficulty_str))
         DSC_PATH = export_path.joinpath(f"{DSC_FILE_NAME}.dsc")
 
-        with open(DSC_PATH,"wb+") as f:
-            f.write(dsc_head)
-            dsc_dict = self.get_dsc_dict()
-            sort_key = sorted(dsc_dict.keys())
-            for key in sort_key:
-                f.write(struct.pack("<2i",DSCCommandID.TIME,key))
-                f.write(dsc_dict[key])
+        with Instrument.stage("creat_dsc_file"), open(DSC_PATH,"wb+") as f:
+            f.write(self.get_dsc_bytes(dsc_head))
+            Instrument.count("bytes", f.tell())
+
+    def get_dsc_bytes(self, dsc_head: bytes = DSC_HEAD) -> bytes:
+        dsc_data = bytearray(dsc_head)
+        dsc_dict = self.get_dsc_dict()
+        sort_key = sorted(dsc_dict.keys())
+        for key in sort_key:
+            dsc_data += struct.pack("<2i",DSCCommandID.TIME,key)
+            dsc_data += dsc_dict[key]
+        return bytes(dsc_data)
     
     def get_event_dict(self) -> dict[int,bytes]:
         event_dict = defaultdict(bytes)
@@ -216,12 +382,11 @@ class DSCManager:
     def get_note_dict(self) -> dict[int,bytes]:
         note_dict = defaultdict(bytes)
         count = 0 # 用于处理在禁区放置Note时计算时间
-        for note_tuple in self.note_mananger.get_note():
-            
-            tick = note_tuple[0].tick
+        data_list = self.note_mananger.data_list
+        for tick, note_slice in self.note_mananger.get_group():
             chart_offset_dsc= int(self.chart_offset * 1000 * 100) 
             data_dict, time = self.tick_manager.tick_to_time(tick, chart_offset_dsc, count)
-            for note in note_tuple:
+            for note in data_list[note_slice]:
                 data_dict[time] += note.dsc_data
             note_dict.update(data_dict)
             count += 1
@@ -0,0 +1,137 @@
+from lib.CsfmReader import TIMELINE_FORMAT
+from array import array
+from pathlib import Path
+import hashlib
+import pickle
+import struct
+import sys
+import os
+
+import logging
+
+logger = logging.getLogger('CsfmCache')
+
+'''
+read_csfm解析结果的缓存文件
+时间轴数据转换为array后作为pickle5的带外缓冲区保存，读取时不需要逐个反序列化数值
+文件结构：
+    头部   : 魔数, 版本, 字节序, pickle长度, 缓冲区数量
+    pickle : 除时间轴数据外的全部内容
+    缓冲区 : 每个缓冲区先写入长度再写入数据
+源文件的大小与blake2b哈希值一致时缓存才有效
+'''
+
+CACHE_MAGIC = b"CSFMC"
+# read_csfm返回值结构变化时需要增加版本号
+CACHE_VERSION = 2
+CACHE_HEAD = struct.Struct("<5sBBQI")
+CACHE_SUFFIX = ".csfmc"
+
+# struct格式到array格式的对应，bool保存为有符号字节
+_ARRAY_TYPECODE = {"i":"i", "b":"b", "?":"b", "h":"h", "f":"f"}
+
+def get_cache_path(csfm_path:Path, cache_dir:Path) -> Path:
+    '''
+    不同目录下可能有同名文件，使用完整路径的哈希区分
+    '''
+    path_hash = hashlib.blake2b(str(csfm_path.absolute()).encode("utf-8"), digest_size=8).hexdigest()
+    return cache_dir.joinpath(f"{csfm_path.stem}-{path_hash}{CACHE_SUFFIX}")
+
+def get_source_hash(data:bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def _pack_timeline(column_dict:dict, format_dict:dict[str,tuple[str,bool]]) -> dict:
+    packed_dict = {}
+    for key, value in column_dict.items():
+        if key not in format_dict or key == "Flags":
+            packed_dict[key] = value
+            continue
+        fmt, is_vet2 = format_dict[key]
+        column = array(_ARRAY_TYPECODE[fmt])
+        if is_vet2:
+            for pair in value:
+                column.extend(pair)
+        else:
+            column.extend(value)
+        packed_dict[key] = (fmt, is_vet2, pickle.PickleBuffer(column))
+    return packed_dict
+
+def _unpack_timeline(packed_dict:dict, format_dict:dict[str,tuple[str,bool]]) -> dict:
+    column_dict = {}
+    for key, value in packed_dict.items():
+        if key not in format_dict or key == "Flags":
+            column_dict[key] = value
+            continue
+        fmt, is_vet2, buffer = value
+        column = array(_ARRAY_TYPECODE[fmt])
+        column.frombytes(buffer)
+        if is_vet2:
+            column_dict[key] = list(zip(column[::2], column[1::2]))
+        elif fmt == "?":
+            column_dict[key] = tuple(map(bool, column))
+        else:
+            column_dict[key] = tuple(column)
+    return column_dict
+
+def save_cache(cache_path:Path, source_data:bytes, data_dict:dict) -> None:
+    chart = dict(data_dict["Chart"])
+    for section, format_dict in TIMELINE_FORMAT.items():
+        if section in chart:
+            chart[section] = _pack_timeline(chart[section], format_dict)
+    cache_dict = {"size":len(source_data), "hash":get_source_hash(source_data),
+                  "data":{**data_dict, "Chart":chart}}
+
+    buffer_list : list[pickle.PickleBuffer] = []
+    payload = pickle.dumps(cache_dict, protocol=5, buffer_callback=buffer_list.append)
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = cache_path.with_suffix(".tmp")
+    with open(temp_path, "wb") as f:
+        f.write(CACHE_HEAD.pack(CACHE_MAGIC, CACHE_VERSION, sys.byteorder == "little", len(payload), len(buffer_list)))
+        f.write(payload)
+        for buffer in buffer_list:
+            raw = buffer.raw()
+            f.write(struct.pack("<Q", raw.nbytes))
+            f.write(raw)
+    # 先写入临时文件再替换，避免中断时留下不完整的缓存
+    os.replace(temp_path, cache_path)
+
+def load_cache(cache_path:Path, source_data:bytes) -> dict|None:
+    '''
+    缓存不存在或已失效时返回None
+    '''
+    try:
+        with open(cache_path, "rb") as f:
+            cache_data = memoryview(f.read())
+    except FileNotFoundError:
+        return None
+
+    try:
+        magic, version, is_little, payload_size, buffer_count = CACHE_HEAD.unpack_from(cache_data)
+        if magic != CACHE_MAGIC or version != CACHE_VERSION or is_little != (sys.byteorder == "little"):
+            logger.debug(f"缓存版本不一致 {cache_path}")
+            return None
+
+        offset = CACHE_HEAD.size
+        payload = cache_data[offset:offset + payload_size]
+        offset += payload_size
+        buffer_list = []
+        for _ in range(buffer_count):
+            size = struct.unpack_from("<Q", cache_data, offset)[0]
+            offset += 8
+            buffer_list.append(cache_data[offset:offset + size])
+            offset += size
+        cache_dict = pickle.loads(payload, buffers=buffer_list)
+    except (struct.error, pickle.UnpicklingError, EOFError, ValueError) as e:
+        logger.warning(f"缓存文件损坏 {cache_path}: {e}")
+        return None
+
+    if cache_dict["size"] != len(source_data) or cache_dict["hash"] != get_source_hash(source_data):
+        logger.debug(f"源文件已变化 {cache_path}")
+        return None
+
+    data_dict = cache_dict["data"]
+    for section, format_dict in TIMELINE_FORMAT.items():
+        if section in data_dict["Chart"]:
+            data_dict["Chart"][section] = _unpack_timeline(data_dict["Chart"][section], format_dict)
+    return data_dict
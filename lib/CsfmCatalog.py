@@ -0,0 +1,176 @@
+from lib.CsfmReader import open_csfm
+from dataclasses import dataclass, fields, astuple
+from pathlib import Path
+from collections.abc import Generator, Mapping
+import sqlite3
+import json
+import os
+import re
+
+import logging
+
+logger = logging.getLogger('CsfmCatalog')
+
+'''
+曲库索引
+以 路径+大小+修改时间 判断文件是否变化，只重新解析变化的文件
+'''
+
+CATALOG_VERSION = 2
+
+@dataclass
+class CatalogEntry:
+    path : str
+    size : int
+    mtime_ns : int
+    pv_id : int
+    difficulty : int
+    is_ex : bool
+    level : str
+    song_title : str|None
+    song_path : str|None
+    movie_path : str|None
+    bg_path : str|None
+    jk_path : str|None
+    logo_path : str|None
+    bpm : float
+    duration : float
+    target_count : int
+    tempo_count : int
+    has_slide : bool
+    has_chance : bool
+    max_notes_per_second : int
+    header : str
+    metadata : str
+
+    @property
+    def metadata_dict(self) -> dict:
+        return json.loads(self.metadata)
+
+_COLUMN_LIST = [item.name for item in fields(CatalogEntry)]
+
+def _to_json(data:Mapping) -> str:
+    return json.dumps({key:(str(value) if isinstance(value, Path) else value) for key, value in data.items()},
+                      ensure_ascii=False)
+
+def _path_str(value:Path|None) -> str|None:
+    return str(value) if value else None
+
+def scan_csfm_file(input_path:Path) -> Generator[tuple[Path, os.stat_result], None, None]:
+    '''
+    只做stat扫描，规则与test.get_csfm_file相同：csfm文件需放在以pv_id命名的文件夹内
+    '''
+    for dir_path, _, file_list in os.walk(input_path):
+        dir_path = Path(dir_path)
+        if dir_path == input_path or not re.match(r"\d+$", dir_path.name):
+            continue
+        for file_name in file_list:
+            if file_name.endswith(".csfm"):
+                csfm_path = dir_path.joinpath(file_name)
+                yield csfm_path, csfm_path.stat()
+
+def read_entry(csfm_path:Path, stat:os.stat_result) -> CatalogEntry:
+    csfm_data = open_csfm(csfm_path)
+    chart = csfm_data["Chart"]
+    metadata = csfm_data["Metadata"]
+    summary = csfm_data["Summary"]
+
+    return CatalogEntry(
+        path = str(csfm_path),
+        size = stat.st_size,
+        mtime_ns = stat.st_mtime_ns,
+        pv_id = int(csfm_path.parent.name),
+        difficulty = chart["Difficulty"]["Type"],
+        is_ex = chart["Difficulty"]["IsEx"],
+        level = chart["Difficulty"]["Level"],
+        song_title = metadata.get("Song Title"),
+        song_path = _path_str(metadata.get("Song File Name")),
+        movie_path = _path_str(metadata.get("Movie File Name")),
+        bg_path = _path_str(metadata.get("Background File Name")),
+        jk_path = _path_str(metadata.get("Cover File Name")),
+        logo_path = _path_str(metadata.get("Logo File Name")),
+        bpm = chart["Tempo Map"]["Tempo"][0] if "Tempo Map" in chart and chart["Tempo Map"].get("Tempo") else 0.0,
+        duration = chart["Time"].get("Duration", 0.0) if "Time" in chart else 0.0,
+        target_count = summary.target_count,
+        tempo_count = len(chart["Tempo Map"].get("Tick", ())) if "Tempo Map" in chart else 0,
+        has_slide = summary.has_slide,
+        has_chance = summary.has_chance,
+        max_notes_per_second = summary.max_notes_per_second,
+        header = _to_json(csfm_data["Header"]),
+        metadata = _to_json(metadata),
+    )
+
+class CsfmCatalog:
+    '''
+    使用SQLite保存的曲库索引
+    refresh只解析新增或变化的文件，并删除已不存在的文件
+    '''
+    def __init__(self, db_path:Path) -> None:
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.__init_table()
+
+    def __enter__(self) -> "CsfmCatalog":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __init_table(self) -> None:
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != CATALOG_VERSION:
+            # 结构变化后直接重建，索引可以随时从曲库重新生成
+            self.connection.execute("DROP TABLE IF EXISTS chart")
+        column_sql = ", ".join(f"{name} PRIMARY KEY" if name == "path" else name for name in _COLUMN_LIST)
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS chart ({column_sql})")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS chart_pv_id ON chart (pv_id)")
+        self.connection.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+        self.connection.commit()
+
+    def refresh(self, input_path:Path) -> tuple[int,int,int]:
+        '''
+        返回 (更新数量, 未变化数量, 删除数量)
+        '''
+        stat_dict = {str(path):(row[0], row[1]) for path, *row in
+                     self.connection.execute("SELECT path, size, mtime_ns FROM chart")}
+        update_count = unchanged_count = 0
+        seen_set = set()
+        for csfm_path, stat in scan_csfm_file(input_path):
+            key = str(csfm_path)
+            seen_set.add(key)
+            if stat_dict.get(key) == (stat.st_size, stat.st_mtime_ns):
+                unchanged_count += 1
+                continue
+            try:
+                entry = read_entry(csfm_path, stat)
+            except Exception as e:
+                logger.warning(f"无法读取 {csfm_path}: {e}")
+                continue
+            self.connection.execute(f"INSERT OR REPLACE INTO chart VALUES ({', '.join('?' * len(_COLUMN_LIST))})",
+                                    astuple(entry))
+            update_count += 1
+
+        removed_list = [(path,) for path in stat_dict if path not in seen_set and Path(path).is_relative_to(input_path)]
+        self.connection.executemany("DELETE FROM chart WHERE path = ?", removed_list)
+        self.connection.commit()
+        logger.info(f"曲库索引：更新 {update_count}，未变化 {unchanged_count}，删除 {len(removed_list)}")
+        return update_count, unchanged_count, len(removed_list)
+
+    def entries(self, where:str = "", params:tuple = ()) -> list[CatalogEntry]:
+        '''
+        where为SQL条件，例如 entries("pv_id = ?", (1,))
+        '''
+        sql = f"SELECT {', '.join(_COLUMN_LIST)} FROM chart"
+        if where:
+            sql += f" WHERE {where}"
+        sql += " ORDER BY pv_id, difficulty, is_ex, path"
+        return [CatalogEntry(*row) for row in self.connection.execute(sql, params)]
+
+    def group_by_pv(self) -> dict[int, list[CatalogEntry]]:
+        pv_dict : dict[int, list[CatalogEntry]] = {}
+        for entry in self.entries():
+            pv_dict.setdefault(entry.pv_id, []).append(entry)
+        return pv_dict
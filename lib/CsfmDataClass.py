@@ -2,7 +2,12 @@ from dataclasses import dataclass, field, InitVar
 import struct
 from pathlib import Path
 from enum import IntEnum, auto
-import FarcCreater
+from collections import Counter
+from bisect import bisect_right
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from FarcCreater import FarcSetting
 
 import logging
 
@@ -32,6 +37,22 @@ class DSCCommandID(IntEnum):
     PV_END = 32
     END = 0
 
+    def get_param_count(self) -> int:
+        '''
+        指令参数数量，用于解析dsc
+        '''
+        match self:
+            case DSCCommandID.TIME: return 1
+            case DSCCommandID.MIKU_DISP: return 2
+            case DSCCommandID.CHANGE_FLELD: return 1
+            case DSCCommandID.MOVIE_PLAY: return 1
+            case DSCCommandID.MOVIE_DISP: return 1
+            case DSCCommandID.MUSIC_PLAY: return 0
+            case DSCCommandID.TARGET_FLYING_TIME: return 1
+            case DSCCommandID.TARGET: return 7
+            case DSCCommandID.PV_END: return 0
+            case DSCCommandID.END: return 0
+
 class ComfyNoteID(IntEnum):
     TRIANGLE = 0
     SQUARE = auto()
@@ -41,6 +62,15 @@ class ComfyNoteID(IntEnum):
     SLIDE_R = auto()
     STAR = auto()
 
+class LinkRole(IntEnum):
+    '''
+    Note在连接（Link）中的位置
+    '''
+    NONE = 0
+    HEAD = auto()
+    MIDDLE = auto()
+    TAIL = auto()
+
 class DSCNoteID(IntEnum):
     # Diva FT
     TRIANGLE = 0
@@ -105,6 +135,7 @@ class DSCNoteID(IntEnum):
             case ComfyNoteID.CIRCLE: return DSCNoteID.CIRCLE
             case ComfyNoteID.SLIDE_L: return DSCNoteID.SLIDE_L
             case ComfyNoteID.SLIDE_R: return DSCNoteID.SLIDE_R
+            case ComfyNoteID.STAR: return DSCNoteID.STAR
 
         raise ValueError(f"不支持的Note类型 {comfy_id}")
     
@@ -135,9 +166,43 @@ class DSCNoteID(IntEnum):
             case ComfyNoteID.CIRCLE: return DSCNoteID.CHANCE_CIRCLE
             case ComfyNoteID.SLIDE_L: return DSCNoteID.CHANCE_SLIDE_L
             case ComfyNoteID.SLIDE_R: return DSCNoteID.CHANCE_SLIDE_R
+            case ComfyNoteID.STAR: return DSCNoteID.CHANGE_STAR
         
         raise ValueError(f"不支持的ChanceNote类型 {comfy_id}")
 
+    @staticmethod
+    def get_long_note_id(comfy_id:int) -> int:
+        match comfy_id:
+            case ComfyNoteID.TRIANGLE: return DSCNoteID.TRIANGLE_LONG
+            case ComfyNoteID.SQUARE: return DSCNoteID.SQUARE_LONG
+            case ComfyNoteID.CROSS: return DSCNoteID.CROSS_LONG
+            case ComfyNoteID.CIRCLE: return DSCNoteID.CIRCLE_LONG
+            case ComfyNoteID.STAR: return DSCNoteID.STAR_LONG
+
+        raise ValueError(f"不支持的LongNote类型 {comfy_id}")
+
+    @staticmethod
+    def get_double_note_id(comfy_id:int) -> int:
+        match comfy_id:
+            case ComfyNoteID.TRIANGLE: return DSCNoteID.UP_W
+            case ComfyNoteID.SQUARE: return DSCNoteID.LEFT_W
+            case ComfyNoteID.CROSS: return DSCNoteID.DOWN_W
+            case ComfyNoteID.CIRCLE: return DSCNoteID.RIGHT_W
+            case ComfyNoteID.STAR: return DSCNoteID.STAR_W
+
+        raise ValueError(f"不支持的DoubleNote类型 {comfy_id}")
+
+    @staticmethod
+    def get_rush_note_id(comfy_id:int) -> int:
+        match comfy_id:
+            case ComfyNoteID.TRIANGLE: return DSCNoteID.TRIANGLE_RUSH
+            case ComfyNoteID.SQUARE: return DSCNoteID.SQUARE_RUSH
+            case ComfyNoteID.CROSS: return DSCNoteID.CROSS_RUSH
+            case ComfyNoteID.CIRCLE: return DSCNoteID.CIRCLE_RUSH
+            case ComfyNoteID.STAR: return DSCNoteID.STAR_RUSH
+
+        raise ValueError(f"不支持的RushNote类型 {comfy_id}")
+
 class Difficulty(IntEnum):
     EASY    = 0
     NORMAL  = auto()
@@ -205,20 +270,42 @@ class ChartInfo:
             ValueError("元数据错误")
 
 
+    def get_movie_file_name(self) -> str:
+        '''
+        视频复制到rom/movie时保留源文件的后缀，pv_db中使用同一个文件名
+        没有视频文件时为usm
+        '''
+        movie_path = self.meta_data.get("movie_path")
+        suffix = Path(movie_path).suffix if movie_path else ".usm"
+        return f"rom/movie/pv_{self.pv_id:03d}{suffix}"
+
+    @staticmethod
+    def get_summary(data:dict) -> "ChartSummary":
+        '''
+        read_csfm只读取部分数据块时Summary为None，此时用已读取的列统计
+        '''
+        summary = data.get("Summary")
+        if summary is None:
+            chart = data["Chart"]
+            ticks_per_beat = chart.get("Scale", {}).get("TicksPerBeat") or 48
+            summary = ChartSummary.from_columns(chart.get("Targets", {}), chart.get("Tempo Map", {}), ticks_per_beat)
+            data["Summary"] = summary
+        return summary
+
     def check_slide(self, data:dict) -> bool:
-            return ComfyNoteID.SLIDE_L in data["Chart"]["Targets"]["Type"] or ComfyNoteID.SLIDE_R in data["Chart"]["Targets"]["Type"]
+        return self.get_summary(data).has_slide
     
     def check_chance(self) -> bool:
         for chart_info in (self.easy,self.normal,self.hard,self.extreme,self.ex_extreme):
-            if chart_info and True in chart_info["Chart"]["Targets"]["Chance"]:
+            if chart_info and self.get_summary(chart_info).has_chance:
                 return True
         
         return False
     
-    def export_chart(self) -> list[str]:
-        from lib.ConvertDSC import DSCManager
-        
-        # 导出2D图
+    def export_spr(self, farc_setting:"FarcSetting|None" = None) -> None:
+        # FarcCreater依赖kkdlib与PIL，只在真正生成2D图时导入
+        import FarcCreater
+
         logger.info("创建2D图")
         spr_dict = {"bg_path":self.meta_data["bg_path"],
                        "jk_path":self.meta_data["jk_path"],
@@ -227,7 +314,17 @@ class ChartInfo:
         spr_dict["bg_path"] = spr_dict["bg_path"] if spr_dict["bg_path"] else Path("default","SONG_BG_DUMMY.png").absolute()
         spr_dict["jk_path"] = spr_dict["jk_path"] if spr_dict["jk_path"] else Path("default","SONG_JK_DUMMY.png").absolute()
 
-        FarcCreater.create_spr_sel_farc(self.pv_id,spr_dict,Path("output","rom","2d"))
+        FarcCreater.create_spr_sel_farc(self.pv_id,spr_dict,Path("output","rom","2d"),setting=farc_setting)
+
+    def export_chart(self, export_spr:bool = True, farc_setting:"FarcSetting|None" = None) -> list[str]:
+        '''
+        export_spr为False时只生成dsc与pv_db，不会加载kkdlib与PIL
+        '''
+        from lib.ConvertDSC import DSCManager
+        
+        # 导出2D图
+        if export_spr:
+            self.export_spr(farc_setting)
         # 初始化
         logger.info("生成db并创建谱面")
         pv_db_list:list[str] = []
@@ -311,7 +408,7 @@ class ChartInfo:
         pv_db_list.append(f"pv_{self.pv_id:03d}.lyric.001=###")
         pv_db_list.append(f"pv_{self.pv_id:03d}.lyric_en.001=###")
         #继续添加其他信息
-        pv_db_list.append(f"pv_{self.pv_id:03d}.movie_file_name=rom/movie/pv_{self.pv_id:03d}.usm")
+        pv_db_list.append(f"pv_{self.pv_id:03d}.movie_file_name={self.get_movie_file_name()}")
         pv_db_list.append(f"pv_{self.pv_id:03d}.movie_pv_type=ONLY")
         pv_db_list.append(f"pv_{self.pv_id:03d}.movie_surface=FRONT") # 调整亮度时需要单独出来处理
         pv_db_list.append(f"pv_{self.pv_id:03d}.performer.0.chara=MIK")
@@ -354,6 +451,79 @@ class VariableDataIndex:
     def item_count(self):
         return int(self.data_size / self.item_size)
 
+@dataclass
+class ChartSummary:
+    '''
+    读取谱面时统计的概要信息，用于生成pv_db与曲库统计
+    tick为空时first_tick与last_tick为0
+    '''
+    target_count : int = 0
+    type_count : dict[int,int] = field(default_factory=dict)
+    hold_count : int = 0
+    chain_count : int = 0
+    chance_count : int = 0
+    first_tick : int = 0
+    last_tick : int = 0
+    max_notes_per_second : int = 0
+    min_bpm : float = 0.0
+    max_bpm : float = 0.0
+
+    @property
+    def has_slide(self) -> bool:
+        return self.type_count.get(ComfyNoteID.SLIDE_L, 0) + self.type_count.get(ComfyNoteID.SLIDE_R, 0) > 0
+
+    @property
+    def has_chance(self) -> bool:
+        return self.chance_count > 0
+
+    @classmethod
+    def from_columns(cls, targets:dict, tempo_map:dict, ticks_per_beat:int = 48) -> "ChartSummary":
+        '''
+        targets需要 Tick, Type, Hold, Chain, Chance
+        tempo_map需要 Tick, Tempo
+        计数都交给Counter与tuple.count，不逐个创建Note
+        '''
+        tick_list = targets.get("Tick") or ()
+        tempo_list = tempo_map.get("Tempo") or ()
+        return cls(
+            target_count = len(tick_list),
+            type_count = {int(key):value for key, value in Counter(targets.get("Type") or ()).items()},
+            hold_count = tuple(targets.get("Hold") or ()).count(True),
+            chain_count = tuple(targets.get("Chain") or ()).count(True),
+            chance_count = tuple(targets.get("Chance") or ()).count(True),
+            first_tick = min(tick_list, default=0),
+            last_tick = max(tick_list, default=0),
+            max_notes_per_second = cls.get_max_density(tick_list, tempo_map.get("Tick") or (), tempo_list, ticks_per_beat),
+            min_bpm = min(tempo_list, default=0.0),
+            max_bpm = max(tempo_list, default=0.0),
+        )
+
+    @staticmethod
+    def get_max_density(tick_list, tempo_tick_list, tempo_list, ticks_per_beat:int) -> int:
+        '''
+        任意1秒内最多的note数量，同一tick的多个note分别计数
+        '''
+        if not tick_list or not tempo_list:
+            return len(tick_list)
+        tempo_point = sorted(zip(tempo_tick_list, tempo_list))
+        # 每个BPM点开始时的秒数
+        change_tick = [tick for tick, _ in tempo_point]
+        change_time = [0.0]
+        for (pre_tick, pre_tempo), (tick, _) in zip(tempo_point, tempo_point[1:]):
+            change_time.append(change_time[-1] + (tick - pre_tick) * 60 / pre_tempo / ticks_per_beat)
+
+        time_list = []
+        for tick in sorted(tick_list):
+            index = max(bisect_right(change_tick, tick) - 1, 0)
+            time_list.append(change_time[index] + (tick - change_tick[index]) * 60 / tempo_point[index][1] / ticks_per_beat)
+
+        max_count = left = 0
+        for right, time in enumerate(time_list):
+            while time - time_list[left] >= 1.0:
+                left += 1
+            max_count = max(max_count, right - left + 1)
+        return max_count
+
 @dataclass
 class BPM:
     tick : int = 0
@@ -402,7 +572,7 @@ class Note:
 
     @property
     def dsc_data(self) -> bytes:
-        dsc_note_id = self.__get_dsc_notetype()
+        dsc_note_id = self.get_dsc_note_id()
         dsc_pos_x = self.__convert_250(self.position[0])
         dsc_pos_y = self.__convert_250(self.position[1])
         dsc_angle = self.__convert_1000(self.angle)
@@ -419,6 +589,9 @@ class Note:
 
         return binary_data
     
+    def get_dsc_note_id(self) -> int:
+        return self.__get_dsc_notetype()
+
     def __get_dsc_notetype(self) -> int:
         if self.ishold:
             return DSCNoteID.get_hold_note_id(comfy_id=self.type)
@@ -448,11 +621,37 @@ class Note:
     
 @dataclass
 class NoteF2X(Note):
+    '''
+    F2nd/X风格的Note
+    link_role由ConvertDSC.resolve_link统一计算，不在Note之间建立引用
+    LongNote在end_tick处额外生成一个相同类型的Note作为结尾，dsc中开始与结尾使用同一个id
+    reference_id只保留读取到的值：dsc的TARGET没有引用其他Note的参数，同时出现的Note由相同的tick表示
+    '''
     islong : bool
     isdouble : bool
+    isrush : bool
+    islink : bool
+    end_tick : int
     reference_id : int
     previous_id : int
     next_id : int
+    link_role : LinkRole = LinkRole.NONE
     
     def __post_init__(self):
-        raise NotImplementedError("Not implemented")
\ No newline at end of file
+        super().__post_init__()
+        # Long与Hold不会同时存在，Long优先
+        if self.islong:
+            self.ishold = False
+
+    def get_dsc_note_id(self) -> int:
+        # 连接从LINK_STAR_START开始，中间的Note继续使用LINK_STAR_START，直到LINK_STAR_END结束
+        match self.link_role:
+            case LinkRole.HEAD | LinkRole.MIDDLE: return DSCNoteID.LINK_STAR_START
+            case LinkRole.TAIL: return DSCNoteID.LINK_STAR_END
+        if self.islong:
+            return DSCNoteID.get_long_note_id(comfy_id=self.type)
+        if self.isdouble:
+            return DSCNoteID.get_double_note_id(comfy_id=self.type)
+        if self.isrush:
+            return DSCNoteID.get_rush_note_id(comfy_id=self.type)
+        return super().get_dsc_note_id()
\ No newline at end of file
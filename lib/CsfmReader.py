@@ -1,14 +1,80 @@
-from lib import ReadCstring
-from lib.CsfmDataClass import VariableDataIndex
+from lib import ReadCstring, Instrument
+from lib.CsfmDataClass import VariableDataIndex, ChartSummary
 import struct
+from io import BytesIO
 from pathlib import Path
 from typing import BinaryIO
+from collections.abc import Iterable, Iterator, Mapping
 
 
 import logging
 
 logger = logging.getLogger('CsfmReader')
 
+CHART_SECTIONS = ("Scale", "Time", "Targets", "Tempo Map", "Button Sounds", "Difficulty", "Events")
+TIMELINE_SECTIONS = ("Targets", "Tempo Map")
+
+# 时间轴数据格式，(struct格式, 是否为二维数据)
+TARGET_FORMAT : dict[str,tuple[str,bool]] = {
+    "Tick":("i",False), "EndTick":("i",False),
+    "NextID":("i",False), "PreviousID":("i",False), "ReferenceID":("i",False),
+    "Type":("b",False),
+    "Properties":("?",False), "Hold":("?",False), "Chain":("?",False), "Chance":("?",False),
+    "Double":("?",False), "Long":("?",False), "Rush":("?",False), "Link":("?",False),
+    "Position":("f",True),
+    "Angle":("f",False), "Frequency":("f",False), "Amplitude":("f",False), "Distance":("f",False),
+}
+
+TEMPO_MAP_FORMAT : dict[str,tuple[str,bool]] = {
+    "Tick":("i",False),
+    "Tempo":("f",False), "Flying Time Factor":("f",False),
+    "Time Signature":("h",True),
+    "Flags":("i",False),
+}
+
+TIMELINE_FORMAT : dict[str,dict[str,tuple[str,bool]]] = {"Targets":TARGET_FORMAT, "Tempo Map":TEMPO_MAP_FORMAT}
+
+# 头部Endianness对应的struct字节序
+ENDIANNESS_FORMAT = {"L":"<", "B":">"}
+
+class _CsfmCodec:
+    '''
+    按文件字节序预先编译的struct，避免每次读取时重新解析格式字符串
+    时间轴数据的struct按 (数量, 类型) 缓存
+    '''
+    def __init__(self, endian: str = "<") -> None:
+        self.endian = endian
+        self.int64 = struct.Struct(f"{endian}q")
+        self.int64x2 = struct.Struct(f"{endian}qq")
+        self.int64x3 = struct.Struct(f"{endian}qqq")
+        self.double = struct.Struct(f"{endian}d")
+        self.version = struct.Struct(f"{endian}hh")
+        self.pointer_size = struct.Struct(f"{endian}h4x")
+        # 按键类型数量, 地址, TicksPerBeat, PlacementAreaSize, FullAngleRotation
+        self.scale = struct.Struct(f"{endian}qqi4xfff4x")
+        self.events_head = struct.Struct(f"{endian}4i")
+        # 每个事件占32字节，只有前12字节有数据
+        self.event = struct.Struct(f"{endian}3i")
+        self.event_stride = 32
+        self.difficulty = struct.Struct(f"{endian}b?bb")
+        self.column_struct : dict[tuple[int,str],struct.Struct] = {}
+
+    @classmethod
+    def from_endianness(cls, endianness: str) -> "_CsfmCodec":
+        if endianness not in ENDIANNESS_FORMAT:
+            logger.warning(f"未知的字节序 {endianness}，按小端读取")
+        return cls(ENDIANNESS_FORMAT.get(endianness, "<"))
+
+    def column(self, count: int, type: str) -> struct.Struct:
+        key = (count, type)
+        if key not in self.column_struct:
+            self.column_struct[key] = struct.Struct(f"{self.endian}{count}{type}")
+        return self.column_struct[key]
+
+    @staticmethod
+    def read(file: BinaryIO, codec_struct: struct.Struct) -> tuple:
+        return codec_struct.unpack(file.read(codec_struct.size))
+
 def _get_bool(data: int, bits: int = 4):
     return tuple(bool((data >> i) & 1) for i in range(bits-1, -1, -1))
 
@@ -45,39 +111,135 @@ class _CsfmReader:
 
             "Chart":{},
 
-            "Debug":"Reserved"}
+            "Debug":"Reserved",
+
+            # 由Targets与Tempo Map统计得到，不是csfm中的数据块
+            "Summary":None}
         self.parent_path = Path()
+        # 文件内容与各数据块地址，用于按需读取
+        self.file : BinaryIO = BytesIO()
+        self.section_address : dict[str,int] = {}
+        self.chart_address : dict[str,int] = {}
+        self.timeline_index : dict[str,dict[str,VariableDataIndex]] = {}
+        self.read_section_set : set[str] = set()
+        self.codec = _CsfmCodec()
     
     def __getstring(self,address: bytes) -> str:
         logger.debug(f"获取 {address} 的对应地址")
-        address = struct.unpack("<q",address)[0]
+        address = self.codec.int64.unpack(address)[0]
         return self.string_address[address]
 
-    def readcsfm(self, _path : Path) -> dict:
+    def readcsfm(self, _path : Path, sections : Iterable[str]|None = None, data : bytes|None = None) -> dict:
+        self.open(_path, data)
+        self.read_sections(sections)
+        if sections is None:
+            self.read_summary()
+        return self.data_dict
+
+    def open(self, _path : Path, data : bytes|None = None) -> None:
+        '''
+        只读取头部信息与各数据块的地址，数据块内容由read_section按需读取
+        data为已读取的文件内容，为None时从_path读取
+        '''
         logger.info(f"正在读取 {_path}")
         self.parent_path = _path.parent
-        with open(_path, "rb") as f:
-            self.head_reader(f)
-            self.creator_info_reader(f)
-            self.data_reader(f)
-        return self.data_dict
+        if data is None:
+            with open(_path, "rb") as f:
+                data = f.read()
+        self.file = BytesIO(data)
+        self.head_reader(self.file)
+        self.creator_info_reader(self.file)
+        self.data_reader(self.file)
+
+    def read_sections(self, sections : Iterable[str]|None = None) -> None:
+        '''
+        按文件中的顺序读取指定的数据块，为None时读取全部
+        可选：Metadata, Debug 与 CHART_SECTIONS 中的名称
+        '''
+        section_set = None if sections is None else set(sections)
+        for section in self.section_address:
+            section_list = self.chart_address if section == "Chart" else (section,)
+            for name in section_list:
+                if section_set is None or name in section_set:
+                    self.read_section(name)
+
+    def read_section(self, name : str) -> None:
+        if name in self.read_section_set:
+            return
+        self.read_section_set.add(name)
+        match name:
+            case "Metadata":
+                if name in self.section_address:
+                    self.metadata_reader(self.file, self.section_address[name])
+            case "Debug":
+                if name in self.section_address:
+                    self.data_dict["Debug"] = ReadCstring.ReadCstringFile2(self.file, self.section_address[name])
+            case _ if name in self.chart_address:
+                self.chart_section_reader(self.file, name, self.chart_address[name])
+
+    def get_timeline_index(self, section : str) -> dict[str,VariableDataIndex]:
+        if section not in self.timeline_index:
+            self.timeline_index[section] = self.__get_timeline_data(self.file, self.chart_address[section]) \
+                                           if section in self.chart_address else {}
+        return self.timeline_index[section]
+
+    def read_column(self, section : str, key : str):
+        '''
+        读取时间轴数据中的一列，未知的列返回None
+        '''
+        info = self.get_timeline_index(section).get(key)
+        format_dict = TIMELINE_FORMAT[section]
+        if info is None or key not in format_dict:
+            return None
+        self.file.seek(info.address)
+        type, is_vet2 = format_dict[key]
+        data = self.__unpack_data(self.file, info, type, is_vet2=is_vet2)
+        if key == "Flags":
+            return tuple(_get_bool(value) for value in data if isinstance(value,int))
+        return data
+
+    def get_column(self, section : str, key : str):
+        '''
+        已读取的列直接返回，否则读取后保存到data_dict
+        '''
+        column_dict = self.data_dict["Chart"].setdefault(section, {})
+        if key not in column_dict:
+            column = self.read_column(section, key)
+            if column is None:
+                return None
+            column_dict[key] = column
+        return column_dict[key]
+
+    def read_summary(self) -> ChartSummary:
+        '''
+        只读取统计需要的列
+        '''
+        if self.data_dict["Summary"] is None:
+            targets = {key:self.get_column("Targets", key) for key in ("Tick", "Type", "Hold", "Chain", "Chance")} \
+                      if "Targets" in self.chart_address else {}
+            tempo_map = {key:self.get_column("Tempo Map", key) for key in ("Tick", "Tempo")} \
+                        if "Tempo Map" in self.chart_address else {}
+            self.read_section("Scale")
+            ticks_per_beat = self.data_dict["Chart"].get("Scale", {}).get("TicksPerBeat") or 48
+            self.data_dict["Summary"] = ChartSummary.from_columns(targets, tempo_map, ticks_per_beat)
+        return self.data_dict["Summary"]
 
     def head_reader(self, file: BinaryIO) -> None:
         logger.info("开始读取头部信息")
-        # [NOTE] 目前没有对数据是否为小端做实际检测，以后可能会出现bug
-        # 先调整逻辑判断便于后续修正
         logger.debug("读取魔数信息")
         self.data_dict["Header"]["Magic"] = file.read(4).decode()
         logger.debug("跳转到指定地址读取大小端信息")
         file.seek(8) # 首先读取大小端，大端为B，小端为L
         self.data_dict["Header"]["Endianness"] = struct.unpack("1sx", file.read(2))[0].decode()
+        # 之后的所有数值都按这里的字节序读取
+        self.codec = _CsfmCodec.from_endianness(self.data_dict["Header"]["Endianness"])
         logger.debug("跳转回前面没有读取的部分读取版本号")
         file.seek(4) # 跳回去读版本号
-        self.data_dict["Header"]["Version"] = "{0}.{1}".format(*struct.unpack("<hh", file.read(4)))
+        self.data_dict["Header"]["Version"] = "{0}.{1}".format(*self.codec.read(file, self.codec.version))
         logger.debug("跳转到没有被读取的部分读取剩余的头部信息")
         file.seek(10) # 跳到后面读剩下的值
-        self.data_dict["Header"]["PointerSize"] = struct.unpack("<h4x", file.read(6))[0]
-        self.data_dict["Header"]["CreationTime"] = struct.unpack("<q", file.read(8))[0]
+        self.data_dict["Header"]["PointerSize"] = self.codec.read(file, self.codec.pointer_size)[0]
+        self.data_dict["Header"]["CreationTime"] = self.codec.read(file, self.codec.int64)[0]
         self.data_dict["Header"]["CharacterEncoding"] = ReadCstring.ReadCstringFile2(file, file.tell())
         pass
 
@@ -85,41 +247,39 @@ class _CsfmReader:
         offset = self.data_dict["Header"]["PointerSize"]
         file.seek(offset)
 
-        self.data_dict["CreatorInfo"]["PointerSize"] = struct.unpack("<q", file.read(8))[0]
+        self.data_dict["CreatorInfo"]["PointerSize"] = self.codec.read(file, self.codec.int64)[0]
         keys = list(self.data_dict["CreatorInfo"].keys())
 
         for index in range(0, int(self.data_dict["CreatorInfo"]["PointerSize"]/8 - 1)):
             file.seek(offset) # 跳转到指定位置
             if index >= len(keys):
-                logger.info(f"未知来源数据：{ReadCstring.ReadCstringFile2(file, struct.unpack("<q", file.read(8))[0])}")
+                logger.info(f"未知来源数据：{ReadCstring.ReadCstringFile2(file, self.codec.read(file, self.codec.int64)[0])}")
             elif keys[index] == "PointerSize":
                 pass
             else:
-                self.data_dict["CreatorInfo"][keys[index]] = ReadCstring.ReadCstringFile2(file, struct.unpack("<q", file.read(8))[0])
+                self.data_dict["CreatorInfo"][keys[index]] = ReadCstring.ReadCstringFile2(file, self.codec.read(file, self.codec.int64)[0])
 
             offset += 8
 
     def __getstring_dict(self,file: BinaryIO, data_offset: int):
         file.seek(data_offset)
-        offset = struct.unpack("<q",file.read(8))[0]
+        offset = self.codec.read(file, self.codec.int64)[0]
         self.string_address = ReadCstring.ReadCstringFile(file,offset)
     
     def data_reader(self, file: BinaryIO) -> None:
         file.seek(self.data_dict["Header"]["PointerSize"]+self.data_dict["CreatorInfo"]["PointerSize"])
-        data_len = struct.unpack("<q",file.read(8))[0]
-        data_offset = struct.unpack("<q",file.read(8))[0]
+        data_len, data_offset = self.codec.read(file, self.codec.int64x2)
         self.__getstring_dict(file,data_offset)
         for _ in range(data_len):
             file.seek(data_offset)
             string = self.__getstring(file.read(8))
-            address = struct.unpack("<q",file.read(8))[0]
+            address = self.codec.read(file, self.codec.int64)[0]
             match string:
-                case "Metadata":
-                    self.metadata_reader(file, address)
+                case "Metadata"|"Debug":
+                    self.section_address[string] = address
                 case "Chart":
+                    self.section_address[string] = address
                     self.chart_reader(file, address)
-                case "Debug":
-                    self.data_dict["Debug"] = ReadCstring.ReadCstringFile2(file, address)
                 case unknow_info:
                     logger.info(f"未知的数据，将会被舍弃 {unknow_info}")
             data_offset += 32
@@ -162,92 +322,82 @@ class _CsfmReader:
                     logger.info(f"未知Metadata数据：{key}")
 
     def chart_reader(self, file: BinaryIO, offset: int) -> None:
+        '''
+        只记录Chart中各数据的地址
+        '''
         address_dict = self.__get_data_address(file, offset)
         for key_address,value_address in address_dict.items():
             assert (isinstance(key_address,bytes) and isinstance(value_address,bytes))
 
             key = self.__getstring(key_address)
-            offset = struct.unpack("<q",value_address)[0]
-            match key:
-                case "Scale":
-                    self.data_dict["Chart"][key] = dict()
-                    self.__get_scale_setting(file, offset)
-                case "Time":
-                    self.data_dict["Chart"][key] = dict()
-                    self.__get_time_setting(file, offset)
-                case "Targets":
-                    self.data_dict["Chart"][key] = dict()
-                    self.__get_target(file, offset)
-                case "Tempo Map":
-                    self.data_dict["Chart"][key] = dict()
-                    self.__get_tempo_map(file, offset)
-                case "Button Sounds":
-                    self.data_dict["Chart"][key] = tuple()
-                    self.__get_button_sound_setting(file, offset)
-                case "Difficulty":
-                    self.data_dict["Chart"][key] = dict()
-                    self.__get_difficulty_setting(file, offset)
-                case "Events":
-                    self.data_dict["Chart"][key] = {"start_tick":[],"end_tick":[],"event_mode":[]}
-                    self.__get_events_setting(file, offset)
-                case unknow_key:
-                    logger.info(f"未知Chart数据：{unknow_key}")
-                    
+            if key in CHART_SECTIONS:
+                self.chart_address[key] = self.codec.int64.unpack(value_address)[0]
+            else:
+                logger.info(f"未知Chart数据：{key}")
+
+    def chart_section_reader(self, file: BinaryIO, key: str, offset: int) -> None:
+        match key:
+            case "Scale":
+                self.data_dict["Chart"][key] = dict()
+                self.__get_scale_setting(file, offset)
+            case "Time":
+                self.data_dict["Chart"][key] = dict()
+                self.__get_time_setting(file, offset)
+            case "Targets":
+                self.data_dict["Chart"][key] = dict()
+                self.__get_target(file, offset)
+            case "Tempo Map":
+                self.data_dict["Chart"][key] = dict()
+                self.__get_tempo_map(file, offset)
+            case "Button Sounds":
+                self.data_dict["Chart"][key] = tuple()
+                self.__get_button_sound_setting(file, offset)
+            case "Difficulty":
+                self.data_dict["Chart"][key] = dict()
+                self.__get_difficulty_setting(file, offset)
+            case "Events":
+                self.data_dict["Chart"][key] = {"start_tick":[],"end_tick":[],"event_mode":[]}
+                self.__get_events_setting(file, offset)
+                
     def __get_events_setting(self, file: BinaryIO, offset: int) -> None:
         file.seek(offset)
         events_dict = self.data_dict["Chart"]["Events"]
-        count = struct.unpack("<4i",file.read(16))[0]
+        count = self.codec.read(file, self.codec.events_head)[0]
         if count > 0:
-            for _ in range(count):
-                events_dict["start_tick"].append(struct.unpack("<i", file.read(4))[0])
-                events_dict["end_tick"].append(struct.unpack("<i", file.read(4))[0])
-                events_dict["event_mode"].append(struct.unpack("<i", file.read(4))[0])
-                file.seek(20,1)
+            data = file.read(count * self.codec.event_stride)
+            for index in range(count):
+                start_tick, end_tick, event_mode = self.codec.event.unpack_from(data, index * self.codec.event_stride)
+                events_dict["start_tick"].append(start_tick)
+                events_dict["end_tick"].append(end_tick)
+                events_dict["event_mode"].append(event_mode)
 
     def __get_scale_setting(self, file: BinaryIO, offset: int) -> None:
         file.seek(offset)
         scale_dict = self.data_dict["Chart"]["Scale"]
 
-        button_type_lenght = struct.unpack("<q",file.read(8))[0]
-        button_type_address = struct.unpack("<q",file.read(8))[0]
+        button_type_lenght, button_type_address, ticks_per_beat, *area_size, full_angle = \
+            self.codec.read(file, self.codec.scale)
 
-        scale_dict["TicksPerBeat"] = struct.unpack("<ii",file.read(8))[0]
-        scale_dict["PlacementAreaSize"] = struct.unpack("<ff",file.read(8))
-        scale_dict["FullAngleRotation"] = struct.unpack("<ff",file.read(8))[0]
+        scale_dict["TicksPerBeat"] = ticks_per_beat
+        scale_dict["PlacementAreaSize"] = tuple(area_size)
+        scale_dict["FullAngleRotation"] = full_angle
         
         scale_dict["ButtonTypeNames"] = list()
         
         for i in range(button_type_lenght):
             file.seek(button_type_address + i * 8)
-            scale_dict["ButtonTypeNames"].append(ReadCstring.ReadCstringFile2(file, struct.unpack("<q", file.read(8))[0]))
+            scale_dict["ButtonTypeNames"].append(ReadCstring.ReadCstringFile2(file, self.codec.read(file, self.codec.int64)[0]))
 
     def __get_target(self, file: BinaryIO, offset: int) -> None:
         '''
         获取Note数据  
         '''
-        data_dict = self.__get_timeline_data(file, offset)
         target_dict = self.data_dict["Chart"]["Targets"]
-        for key,value in data_dict.items():
-            file.seek(value.address)
-            match key:
-                case "Tick"|"EndTick"|"NextID"|"PreviousID"|"ReferenceID":
-                    target_dict[key] = self.__unpack_data(file, value, "i")
-
-                case "Type":
-                    target_dict[key] = self.__unpack_data(file, value, "b")
-
-                case "Properties"|"Hold"|"Chain"|"Chance"|"Double"|"Long"|"Rush"|"Link":
-                    target_dict[key] = self.__unpack_data(file, value, "?")
-
-                case "Position":
-                    target_dict[key] = self.__unpack_data(file, value, "f", is_vet2=True)
-
-                case "Angle"|"Frequency"|"Amplitude"|"Distance":
-                    target_dict[key] = self.__unpack_data(file, value, "f")
-
-                case unknow_param:
-                    logger.info(f"未知参数: {unknow_param}")
-                    pass
+        for key in self.get_timeline_index("Targets"):
+            if key in TARGET_FORMAT:
+                target_dict[key] = self.read_column("Targets", key)
+            else:
+                logger.info(f"未知参数: {key}")
 
     def __get_tempo_map(self, file: BinaryIO, offset: int) -> None:
         '''
@@ -259,20 +409,10 @@ class _CsfmReader:
                 第二位是Flying Time
                 第三位是拍号是否改变
         '''
-        data_dict = self.__get_timeline_data(file, offset)
         temp_map_dict = self.data_dict["Chart"]["Tempo Map"]
-        for key,value in data_dict.items():
-            file.seek(value.address)
-            match key:
-                case "Tick":
-                    temp_map_dict[key] = self.__unpack_data(file, value, "i")
-                case "Tempo"|"Flying Time Factor":
-                    temp_map_dict[key] = self.__unpack_data(file, value, "f")
-                case "Time Signature":
-                    temp_map_dict[key] = self.__unpack_data(file, value, "h", is_vet2=True)
-                case "Flags":
-                    data = self.__unpack_data(file, value, "i")
-                    temp_map_dict[key] = tuple(_get_bool(value) for value in data if isinstance(value,int))
+        for key in self.get_timeline_index("Tempo Map"):
+            if key in TEMPO_MAP_FORMAT:
+                temp_map_dict[key] = self.read_column("Tempo Map", key)
 
     def __get_time_setting(self, file: BinaryIO, offset: int) -> None:
         '''
@@ -284,7 +424,7 @@ class _CsfmReader:
             assert (isinstance(key_address,bytes) and isinstance(value_byte,bytes))
 
             key = self.__getstring(key_address)
-            value = struct.unpack("<d",value_byte)[0]
+            value = self.codec.double.unpack(value_byte)[0]
             if key == "Duration" and value == 0.0:
                 self.data_dict["Chart"]["Time"][key] = 90.0
             else:
@@ -297,15 +437,14 @@ class _CsfmReader:
         '''
         length, address = self.__get_data_length(file, offset)
         file.seek(address)
-        self.data_dict["Chart"]["Button Sounds"] = struct.unpack("<bbbb",file.read(length))
+        self.data_dict["Chart"]["Button Sounds"] = self.codec.read(file, self.codec.column(length, "b"))
 
     def __get_difficulty_setting(self, file: BinaryIO, offset: int) -> None:
         '''
         获取难度设置
         '''
         file.seek(offset)
-        file_data = file.read(4)
-        data = struct.unpack("b?bb",file_data)
+        data = self.codec.read(file, self.codec.difficulty)
         self.data_dict["Chart"]["Difficulty"] = {
             "Type":data[0],
             "IsEx":data[1],
@@ -319,12 +458,12 @@ class _CsfmReader:
         file.seek(offset)
         #暂时不清楚valuelength有什么作用，因为我们完全可以根据数据长度获取到值的数量
         #也许只是为了方便验证数量值，姑且先用一个变量保存
-        value_length,key_length,address = struct.unpack("<qqq",file.read(24))
+        value_length,key_length,address = self.codec.read(file, self.codec.int64x3)
         data_address_dict = {}
         file.seek(address)
         for _ in range(key_length):
             key = self.__getstring(file.read(8))
-            value = VariableDataIndex(*struct.unpack("<qqq",file.read(24)))
+            value = VariableDataIndex(*self.codec.read(file, self.codec.int64x3))
             data_address_dict[key] = value
             file.seek(16,1)
 
@@ -332,7 +471,7 @@ class _CsfmReader:
 
     def __get_data_length(self, file: BinaryIO, offset: int) -> tuple[int,int]:
         file.seek(offset)
-        return struct.unpack("<qq",file.read(16))
+        return self.codec.read(file, self.codec.int64x2)
 
     def __get_data_address(self, file: BinaryIO, offset: int) -> dict[int,int]:
         length, address = self.__get_data_length(file, offset)
@@ -350,11 +489,108 @@ class _CsfmReader:
     def __unpack_data(self, file: BinaryIO, info: VariableDataIndex, type: str, is_vet2: bool =False):
         data = file.read(info.data_size)
         if not is_vet2:
-            return struct.unpack(f"<{info.item_count}{type}",data)
-        unpack_data = struct.unpack(f"<{info.item_count*2}{type}",data)
+            return self.codec.column(info.item_count, type).unpack(data)
+        unpack_data = self.codec.column(info.item_count*2, type).unpack(data)
         return list(zip(unpack_data[::2],unpack_data[1::2]))
     
 
-def read_csfm(_file_path: Path) -> dict:
-
-    return _CsfmReader().readcsfm(_file_path)
+class _LazyTimeline(Mapping):
+    '''
+    时间轴数据，每一列在第一次访问时读取
+    '''
+    def __init__(self, reader: _CsfmReader, section: str) -> None:
+        self.reader = reader
+        self.section = section
+        self.data_dict : dict = reader.data_dict["Chart"].setdefault(section, {})
+        self.key_list = [key for key in reader.get_timeline_index(section) if key in TIMELINE_FORMAT[section]]
+
+    def __getitem__(self, key: str):
+        if key not in self.data_dict:
+            if key not in self.key_list:
+                raise KeyError(key)
+            self.data_dict[key] = self.reader.read_column(self.section, key)
+        return self.data_dict[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.key_list)
+
+    def __len__(self) -> int:
+        return len(self.key_list)
+
+class _LazyChart(Mapping):
+    def __init__(self, reader: _CsfmReader) -> None:
+        self.reader = reader
+        self.timeline_dict : dict[str,_LazyTimeline] = {}
+
+    def __getitem__(self, key: str):
+        if key not in self.reader.chart_address:
+            raise KeyError(key)
+        if key in TIMELINE_SECTIONS:
+            if key not in self.timeline_dict:
+                self.timeline_dict[key] = _LazyTimeline(self.reader, key)
+            return self.timeline_dict[key]
+        self.reader.read_section(key)
+        return self.reader.data_dict["Chart"][key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.reader.chart_address)
+
+    def __len__(self) -> int:
+        return len(self.reader.chart_address)
+
+class CsfmDocument(Mapping):
+    '''
+    与read_csfm返回值结构相同，但数据块与时间轴的每一列都在第一次访问时才读取
+    只需要元数据时（如生成pv_db、扫描曲库）不会解析Targets与Events
+    '''
+    def __init__(self, reader: _CsfmReader) -> None:
+        self.reader = reader
+        self.chart = _LazyChart(reader)
+
+    def __getitem__(self, key: str):
+        match key:
+            case "Header"|"CreatorInfo":
+                return self.reader.data_dict[key]
+            case "Metadata"|"Debug":
+                self.reader.read_section(key)
+                return self.reader.data_dict[key]
+            case "Chart":
+                return self.chart
+            case "Summary":
+                return self.reader.read_summary()
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.reader.data_dict)
+
+    def __len__(self) -> int:
+        return len(self.reader.data_dict)
+
+def read_csfm(_file_path: Path, sections: Iterable[str]|None = None, cache_dir: Path|None = None) -> dict:
+    '''
+    sections为None时读取全部数据并统计Summary，否则只读取指定的数据块，Summary为None
+    指定cache_dir时读取全部数据的结果会缓存到该目录，源文件未变化时直接读取缓存
+    '''
+    with Instrument.stage("read_csfm"):
+        Instrument.count("bytes", _file_path.stat().st_size)
+        if cache_dir is None or sections is not None:
+            return _CsfmReader().readcsfm(_file_path, sections)
+
+        from lib import CsfmCache
+        source_data = _file_path.read_bytes()
+        cache_path = CsfmCache.get_cache_path(_file_path, cache_dir)
+        data_dict = CsfmCache.load_cache(cache_path, source_data)
+        if data_dict is not None:
+            Instrument.count("cache_hit")
+            return data_dict
+
+        data_dict = _CsfmReader().readcsfm(_file_path, data=source_data)
+        CsfmCache.save_cache(cache_path, source_data, data_dict)
+        return data_dict
+
+def open_csfm(_file_path: Path) -> CsfmDocument:
+    with Instrument.stage("open_csfm"):
+        Instrument.count("bytes", _file_path.stat().st_size)
+        reader = _CsfmReader()
+        reader.open(_file_path)
+        return CsfmDocument(reader)
@@ -0,0 +1,301 @@
+from dataclasses import dataclass
+from pathlib import Path
+import random
+import struct
+from lib.CsfmReader import TARGET_FORMAT, TEMPO_MAP_FORMAT, ENDIANNESS_FORMAT
+
+import logging
+
+logger = logging.getLogger('CsfmWriter')
+
+'''
+按照_CsfmReader的读取方式生成csfm文件
+主要用于生成测试与性能测试用的谱面，不保证与Comfy生成的文件完全一致
+字符串统一放在文件末尾，起始地址为第一个数据块名称的地址
+'''
+
+HEADER_SIZE = 64
+CREATOR_INFO_KEYS = ("Name", "Platform", "Architecture", "Author", "CommitHash", "CommitTime",
+                     "CommitNumber", "Branch", "CompileTime", "BuildConfig")
+
+class _CsfmBuilder:
+    '''
+    简单的顺序分配器
+    指向字符串的指针先记录位置，字符串池确定后再统一回填
+    '''
+    def __init__(self, endian:str = "<") -> None:
+        self.endian = endian
+        self.buf = bytearray()
+        self.string_list : list[str] = []
+        self.string_index : dict[str,int] = {}
+        self.string_refs : list[tuple[int,str]] = []
+
+    def alloc(self, size:int, align:int = 8) -> int:
+        offset = len(self.buf) + (-len(self.buf) % align)
+        self.buf.extend(bytes(offset + size - len(self.buf)))
+        return offset
+
+    def pack_into(self, fmt:str, offset:int, *args) -> None:
+        struct.pack_into(self.endian + fmt, self.buf, offset, *args)
+
+    def intern(self, string:str) -> None:
+        if string not in self.string_index:
+            self.string_index[string] = len(self.string_list)
+            self.string_list.append(string)
+
+    def string_ref(self, offset:int, string:str) -> None:
+        self.intern(string)
+        self.string_refs.append((offset, string))
+
+    def finish(self) -> bytes:
+        pool_start = self.alloc(0)
+        address_dict : dict[str,int] = {}
+        for string in self.string_list:
+            address_dict[string] = len(self.buf)
+            self.buf.extend(string.encode("utf-8") + b"\x00")
+        for offset, string in self.string_refs:
+            self.pack_into("q", offset, address_dict[string])
+        logger.debug(f"字符串池起始地址 {pool_start}，共 {len(self.string_list)} 个字符串")
+        return bytes(self.buf)
+
+    def write_dict(self, entry_list:list[tuple[str,object]], value_writer) -> int:
+        '''
+        写入 (长度, 地址) 结构的字典，每项32字节
+        value_writer负责把值写入项内第8字节处
+        '''
+        offset = self.alloc(16)
+        address = self.alloc(32 * len(entry_list))
+        self.pack_into("qq", offset, len(entry_list), address)
+        for key, value in entry_list:
+            self.string_ref(address, key)
+            value_writer(address + 8, value)
+            address += 32
+        return offset
+
+    def write_timeline(self, column_dict:dict, format_dict:dict[str,tuple[str,bool]]) -> int:
+        column_list = [(key, value) for key, value in column_dict.items() if key in format_dict]
+        item_count = len(column_list[0][1]) if column_list else 0
+
+        offset = self.alloc(24)
+        address = self.alloc(48 * len(column_list))
+        self.pack_into("qqq", offset, item_count, len(column_list), address)
+        for key, value in column_list:
+            fmt, is_vet2 = format_dict[key]
+            if key == "Flags":
+                value = [self.__flags_to_int(flags) for flags in value]
+            if is_vet2:
+                value = [item for pair in value for item in pair]
+            data = struct.pack(f"{self.endian}{len(value)}{fmt}", *value)
+            data_address = self.alloc(len(data))
+            self.buf[data_address:data_address + len(data)] = data
+
+            item_size = struct.calcsize(fmt) * (2 if is_vet2 else 1)
+            self.string_ref(address, key)
+            self.pack_into("qqq", address + 8, item_size, len(data), data_address)
+            address += 48
+        return offset
+
+    @staticmethod
+    def __flags_to_int(flags:int|tuple[bool,...]) -> int:
+        if isinstance(flags, int):
+            return flags
+        value = 0
+        for flag in flags:
+            value = (value << 1) | int(flag)
+        return value
+
+def _path_to_str(value, parent_path:Path) -> str:
+    if isinstance(value, Path):
+        try:
+            return str(value.relative_to(parent_path))
+        except ValueError:
+            return str(value)
+    return str(value)
+
+def write_csfm(_file_path:Path, data_dict:dict, endianness:str = "L") -> int:
+    '''
+    将与read_csfm返回值结构相同的字典写入文件，返回写入的字节数
+    endianness为L（小端）或B（大端）
+    '''
+    builder = _CsfmBuilder(ENDIANNESS_FORMAT[endianness])
+    header = data_dict.get("Header", {})
+    creator_info = data_dict.get("CreatorInfo", {})
+    metadata = {key:value for key, value in data_dict.get("Metadata", {}).items() if value is not None}
+    chart = data_dict["Chart"]
+
+    # 头部信息
+    builder.alloc(HEADER_SIZE)
+    builder.buf[0:4] = (header.get("Magic") or "CSFM").encode()[:4].ljust(4, b"\x00")
+    major, minor = (int(i) for i in (header.get("Version") or "1.0").split("."))
+    builder.pack_into("hh", 4, major, minor)
+    builder.buf[8:9] = endianness.encode()
+    builder.pack_into("h", 10, HEADER_SIZE)
+    builder.pack_into("q", 16, header.get("CreationTime") or 0)
+    encoding = (header.get("CharacterEncoding") or "UTF-8").encode() + b"\x00"
+    builder.buf[24:24 + len(encoding)] = encoding
+
+    # 创建者信息，第一项为自身大小
+    creator_info_size = 8 * (len(CREATOR_INFO_KEYS) + 2)
+    creator_offset = builder.alloc(creator_info_size)
+    builder.pack_into("q", creator_offset, creator_info_size)
+
+    # 数据块列表，第一个名称作为字符串池起点
+    data_head = builder.alloc(16)
+    section_list = ["Metadata", "Chart", "Debug"]
+    section_address = builder.alloc(32 * len(section_list))
+    builder.pack_into("qq", data_head, len(section_list), section_address)
+    for section in section_list:
+        builder.intern(section)
+
+    for index, key in enumerate(CREATOR_INFO_KEYS, start=1):
+        builder.string_ref(creator_offset + index * 8, creator_info.get(key) or "")
+
+    metadata_offset = builder.write_dict(
+        [(key, _path_to_str(value, _file_path.parent)) for key, value in metadata.items()],
+        builder.string_ref)
+
+    chart_entry_list = []
+    if "Scale" in chart:
+        chart_entry_list.append(("Scale", _write_scale(builder, chart["Scale"])))
+    if "Time" in chart:
+        time_offset = builder.write_dict(list(chart["Time"].items()),
+                                         lambda offset, value: builder.pack_into("d", offset, value))
+        chart_entry_list.append(("Time", time_offset))
+    if "Targets" in chart:
+        chart_entry_list.append(("Targets", builder.write_timeline(chart["Targets"], TARGET_FORMAT)))
+    if "Tempo Map" in chart:
+        chart_entry_list.append(("Tempo Map", builder.write_timeline(chart["Tempo Map"], TEMPO_MAP_FORMAT)))
+    if "Button Sounds" in chart:
+        chart_entry_list.append(("Button Sounds", _write_button_sounds(builder, chart["Button Sounds"])))
+    if "Difficulty" in chart:
+        chart_entry_list.append(("Difficulty", _write_difficulty(builder, chart["Difficulty"])))
+    if "Events" in chart:
+        chart_entry_list.append(("Events", _write_events(builder, chart["Events"])))
+    chart_offset = builder.write_dict(chart_entry_list,
+                                      lambda offset, value: builder.pack_into("q", offset, value))
+
+    for index, (section, address) in enumerate(zip(section_list, (metadata_offset, chart_offset, 0))):
+        entry = section_address + index * 32
+        builder.string_ref(entry, section)
+        if section == "Debug":
+            builder.string_ref(entry + 8, data_dict.get("Debug") or "Reserved")
+        else:
+            builder.pack_into("q", entry + 8, address)
+
+    for string in data_dict.get("StringPool", ()):
+        builder.intern(string)
+
+    data = builder.finish()
+    with open(_file_path, "wb") as f:
+        f.write(data)
+    return len(data)
+
+def _write_scale(builder:_CsfmBuilder, scale_dict:dict) -> int:
+    name_list = scale_dict.get("ButtonTypeNames", [])
+    offset = builder.alloc(40)
+    name_address = builder.alloc(8 * len(name_list))
+    builder.pack_into("qqi4xff4x", offset, len(name_list), name_address,
+                      scale_dict.get("TicksPerBeat", 48), *scale_dict.get("PlacementAreaSize", (1920.0, 1080.0)))
+    builder.pack_into("f", offset + 32, scale_dict.get("FullAngleRotation", 360.0))
+    for index, name in enumerate(name_list):
+        builder.string_ref(name_address + index * 8, name)
+    return offset
+
+def _write_button_sounds(builder:_CsfmBuilder, button_sounds:tuple) -> int:
+    offset = builder.alloc(16)
+    address = builder.alloc(len(button_sounds))
+    builder.pack_into("qq", offset, len(button_sounds), address)
+    builder.pack_into(f"{len(button_sounds)}b", address, *button_sounds)
+    return offset
+
+def _write_difficulty(builder:_CsfmBuilder, diff_dict:dict) -> int:
+    level, sub_level = (int(i) for i in str(diff_dict.get("Level", "00_0")).split("_"))
+    offset = builder.alloc(4)
+    builder.pack_into("b?bb", offset, diff_dict["Type"], diff_dict["IsEx"], level, sub_level)
+    return offset
+
+def _write_events(builder:_CsfmBuilder, events_dict:dict) -> int:
+    count = len(events_dict["start_tick"])
+    offset = builder.alloc(16 + 32 * count)
+    builder.pack_into("4i", offset, count, 0, 0, 0)
+    for index, event in enumerate(zip(events_dict["start_tick"], events_dict["end_tick"], events_dict["event_mode"])):
+        builder.pack_into("3i", offset + 16 + index * 32, *event)
+    return offset
+
+@dataclass
+class SyntheticChartSetting:
+    '''
+    生成测试谱面用的参数
+    '''
+    seed : int = 0
+    target_count : int = 1000
+    tempo_count : int = 8
+    event_count : int = 4
+    string_count : int = 0
+    difficulty : int = 3
+    is_ex : bool = False
+
+def generate_csfm_data(setting:SyntheticChartSetting) -> dict:
+    '''
+    使用固定种子生成随机谱面，结构与read_csfm返回值相同
+    只生成ConvertDSC支持的Note组合（Hold只用于四键，Chain只用于滑键）
+    '''
+    rng = random.Random(setting.seed)
+    ticks_per_target = 12
+
+    targets : dict[str,list] = {key:[] for key in ("Tick", "Type", "Properties", "Hold", "Chain", "Chance",
+                                                   "Position", "Angle", "Frequency", "Amplitude", "Distance")}
+    tick = 192
+    while len(targets["Tick"]) < setting.target_count:
+        tick += rng.choice((0, ticks_per_target, ticks_per_target, 24, 48)) if targets["Tick"] else 0
+        note_type = rng.randrange(6)
+        is_slide = note_type >= 4
+        targets["Tick"].append(tick)
+        targets["Type"].append(note_type)
+        targets["Properties"].append(rng.random() < 0.5)
+        targets["Hold"].append(not is_slide and rng.random() < 0.1)
+        targets["Chain"].append(is_slide and rng.random() < 0.2)
+        targets["Chance"].append(rng.random() < 0.05)
+        # 取0.25的倍数，保证写入float后读取的值不变
+        targets["Position"].append((rng.randrange(0, 1920 * 4) / 4, rng.randrange(0, 1080 * 4) / 4))
+        targets["Angle"].append(rng.randrange(-180 * 4, 180 * 4) / 4)
+        targets["Frequency"].append(float(rng.choice((-2, 0, 2))))
+        targets["Amplitude"].append(500.0)
+        targets["Distance"].append(rng.randrange(800 * 4, 1600 * 4) / 4)
+
+    tempo_map : dict[str,list] = {"Tick":[0], "Tempo":[160.0], "Flying Time Factor":[1.0],
+                                  "Time Signature":[(4, 4)], "Flags":[(False, True, True, True)]}
+    if setting.tempo_count > 1:
+        change_tick_list = sorted(rng.sample(range(48, max(tick, 49)), k=min(setting.tempo_count - 1, max(tick - 48, 1))))
+        for change_tick in change_tick_list:
+            tempo_map["Tick"].append(change_tick)
+            tempo_map["Tempo"].append(float(rng.randrange(80, 260)))
+            tempo_map["Flying Time Factor"].append(rng.choice((0.5, 1.0, 1.0, 2.0)))
+            tempo_map["Time Signature"].append((4, 4))
+            tempo_map["Flags"].append((False, True, rng.random() < 0.5, False))
+
+    events : dict[str,list] = {"start_tick":[], "end_tick":[], "event_mode":[]}
+    for _ in range(setting.event_count):
+        start_tick = rng.randrange(0, max(tick, 1))
+        events["start_tick"].append(start_tick)
+        events["end_tick"].append(start_tick + rng.randrange(48, 960))
+        events["event_mode"].append(rng.randrange(3))
+
+    duration = tick * 60 / 160 / 48 + 10.0
+    return {
+        "Header":{"Magic":"CSFM", "Version":"1.0", "CreationTime":setting.seed, "CharacterEncoding":"UTF-8"},
+        "CreatorInfo":{"Name":"CsfmWriter", "Author":"synthetic"},
+        "Metadata":{"Song Title":f"Synthetic {setting.seed}", "Artist":"synthetic"},
+        "Chart":{
+            "Scale":{"TicksPerBeat":48, "PlacementAreaSize":(1920.0, 1080.0), "FullAngleRotation":360.0,
+                     "ButtonTypeNames":["Triangle", "Square", "Cross", "Circle", "Slide L", "Slide R"]},
+            "Time":{"Song Offset":0.0, "Movie Offset":0.0, "Duration":duration,
+                    "Song Preview Start":0.0, "Song Preview Duration":10.0},
+            "Targets":targets,
+            "Tempo Map":tempo_map,
+            "Button Sounds":(0, 0, 0, 0),
+            "Difficulty":{"Type":setting.difficulty, "IsEx":setting.is_ex, "Level":"07_5"},
+            "Events":events},
+        "Debug":"Reserved",
+        "StringPool":[f"synthetic_string_{rng.getrandbits(32):08x}_{i}" for i in range(setting.string_count)],
+    }
@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import struct
+import zlib
+import os
+
+import logging
+
+logger = logging.getLogger('FarcWriter')
+
+'''
+写入gzip压缩的FArC文件
+文件结构（大端）：
+    "FArC", 头部长度, 对齐(0x10)
+    每个文件：文件名\\0, 数据地址, 压缩后大小, 原始大小
+    按对齐填充后依次写入每个文件的gzip数据
+大文件分块并行deflate，各块拼接后仍是一个完整的gzip流，普通的zlib即可解压
+'''
+
+FARC_MAGIC = b"FArC"
+FARC_ALIGNMENT = 0x10
+# 分块大小与每块预置字典的大小（deflate窗口为32KB）
+CHUNK_SIZE = 1 << 20
+WINDOW_SIZE = 1 << 15
+# gzip头：无文件名，mtime为0，系统未知
+GZIP_HEAD = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+def _deflate_chunk(data:memoryview, start:int, end:int, level:int) -> bytes:
+    '''
+    使用前一块末尾32KB作为字典，压缩率与整体压缩接近
+    非最后一块使用Z_SYNC_FLUSH结束，保证按字节对齐且不写入结束标记
+    '''
+    zdict = data[max(start - WINDOW_SIZE, 0):start]
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL,
+                                  zlib.Z_DEFAULT_STRATEGY, *((zdict,) if start > 0 else ()))
+    chunk = compressor.compress(data[start:end])
+    return chunk + compressor.flush(zlib.Z_FINISH if end == len(data) else zlib.Z_SYNC_FLUSH)
+
+def gzip_compress(data:bytes, level:int = 6, workers:int|None = None, chunk_size:int = CHUNK_SIZE) -> bytes:
+    '''
+    数据不超过两块或workers为1时直接压缩
+    zlib压缩时会释放GIL，因此使用线程即可并行
+    '''
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(data) <= chunk_size * 2:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    view = memoryview(data)
+    start_list = range(0, len(data), chunk_size)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        chunk_list = list(executor.map(lambda start: _deflate_chunk(view, start, min(start + chunk_size, len(data)), level),
+                                       start_list))
+    logger.debug(f"{len(data)} 字节分为 {len(chunk_list)} 块压缩")
+    trailer = struct.pack("<II", zlib.crc32(data), len(data) & 0xFFFFFFFF)
+    return b"".join((GZIP_HEAD, *chunk_list, trailer))
+
+def _align(offset:int) -> int:
+    return offset + (-offset % FARC_ALIGNMENT)
+
+def write_farc(path:Path, file_list:list[tuple[str, bytes]], level:int = 6, workers:int|None = None) -> int:
+    '''
+    file_list为 (文件名, 数据)，返回写入的字节数
+    '''
+    compressed_list = [gzip_compress(data, level, workers) for _, data in file_list]
+    name_list = [name.encode("utf-8") + b"\x00" for name, _ in file_list]
+
+    # 头部长度从对齐字段开始计算
+    head_size = 4 + sum(len(name) + 12 for name in name_list)
+    offset = _align(8 + head_size)
+    head = bytearray(FARC_MAGIC + struct.pack(">II", head_size, FARC_ALIGNMENT))
+    for name, compressed, (_, data) in zip(name_list, compressed_list, file_list):
+        head += name + struct.pack(">III", offset, len(compressed), len(data))
+        offset = _align(offset + len(compressed))
+
+    with open(path, "wb") as f:
+        f.write(head)
+        for compressed in compressed_list:
+            f.write(bytes(_align(f.tell()) - f.tell()))
+            f.write(compressed)
+        return f.tell()
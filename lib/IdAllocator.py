@@ -0,0 +1,41 @@
+from threading import Lock
+
+'''
+按实例分配的递增ID，分配与reserve有锁保护
+每个Farc与Manager持有自己的分配器，不同实例之间互不影响
+start用于指定起始值，相同的start与调用顺序得到相同的ID
+'''
+
+class IdAllocator:
+    def __init__(self, start:int = 0) -> None:
+        self.start = start
+        self._next = start
+        self._lock = Lock()
+
+    @property
+    def next_id(self) -> int:
+        '''
+        下一个将要分配的ID，不会分配
+        '''
+        return self._next
+
+    def allocate(self) -> int:
+        with self._lock:
+            value = self._next
+            self._next += 1
+            return value
+
+    def reserve(self, value:int) -> None:
+        '''
+        标记value已被使用，之后分配的ID都大于value
+        读取已有数据时使用
+        '''
+        with self._lock:
+            if value >= self._next:
+                self._next = value + 1
+
+    def reset(self, start:int|None = None) -> None:
+        with self._lock:
+            if start is not None:
+                self.start = start
+            self._next = self.start
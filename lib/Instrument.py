@@ -0,0 +1,176 @@
+from dataclasses import dataclass, field, asdict
+from contextlib import contextmanager
+from collections.abc import Generator
+from pathlib import Path
+import threading
+import cProfile
+import tracemalloc
+import time
+import json
+import csv
+
+import logging
+
+logger = logging.getLogger('Instrument')
+
+@dataclass
+class StageRecord:
+    '''
+    单个PV单个阶段的统计
+    pv_id为None时表示不属于任何PV的全局阶段（如写入mod_spr_db）
+    '''
+    pv_id : int|None
+    stage : str
+    calls : int = 0
+    elapsed : float = 0.0
+    peak_memory : int = 0
+    counters : dict[str,int] = field(default_factory=dict)
+
+class RunReport:
+    '''
+    记录转换流程中每个PV每个阶段的耗时与计数
+    profile为True时在最外层阶段内启用cProfile
+    trace_memory为True时使用tracemalloc记录各阶段内存峰值
+    当前PV与阶段栈按线程保存，工作线程需要自己用pv()指定所属的PV
+    cProfile与tracemalloc的峰值是整个进程共用的，只在主线程中记录
+    '''
+    def __init__(self, profile:bool = False, trace_memory:bool = False) -> None:
+        self.records : dict[tuple[int|None,str],StageRecord] = {}
+        self.profiler : cProfile.Profile|None = cProfile.Profile() if profile else None
+        self.trace_memory : bool = trace_memory
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @property
+    def pv_id(self) -> int|None:
+        return getattr(self._local, "pv_id", None)
+
+    @pv_id.setter
+    def pv_id(self, pv_id:int|None) -> None:
+        self._local.pv_id = pv_id
+
+    @property
+    def _stage_stack(self) -> list[list]:
+        '''
+        嵌套阶段栈，记录阶段名与子阶段的内存峰值
+        '''
+        if not hasattr(self._local, "stage_stack"):
+            self._local.stage_stack = []
+        return self._local.stage_stack
+
+    def get_record(self, stage:str) -> StageRecord:
+        key = (self.pv_id, stage)
+        with self._lock:
+            if key not in self.records:
+                self.records[key] = StageRecord(self.pv_id, stage)
+            return self.records[key]
+
+    @contextmanager
+    def pv(self, pv_id:int) -> Generator[None, None, None]:
+        pre_pv_id = self.pv_id
+        self.pv_id = pv_id
+        try:
+            yield
+        finally:
+            self.pv_id = pre_pv_id
+
+    @contextmanager
+    def stage(self, name:str) -> Generator[StageRecord, None, None]:
+        record = self.get_record(name)
+        stage_stack = self._stage_stack
+        is_outermost = not stage_stack
+        is_main = threading.current_thread() is threading.main_thread()
+        trace_memory = self.trace_memory and is_main
+        stage_stack.append([name, 0])
+
+        if trace_memory:
+            tracemalloc.reset_peak()
+        if self.profiler and is_outermost and is_main:
+            self.profiler.enable()
+
+        start_time = time.perf_counter()
+        try:
+            yield record
+        finally:
+            elapsed = time.perf_counter() - start_time
+            with self._lock:
+                record.elapsed += elapsed
+                record.calls += 1
+
+            if self.profiler and is_outermost and is_main:
+                self.profiler.disable()
+
+            _, child_peak = stage_stack.pop()
+            if trace_memory:
+                peak = max(tracemalloc.get_traced_memory()[1], child_peak)
+                record.peak_memory = max(record.peak_memory, peak)
+                # reset_peak会清掉外层阶段的峰值，需要手动传递给外层
+                if stage_stack:
+                    stage_stack[-1][1] = max(stage_stack[-1][1], peak)
+
+    def count(self, name:str, value:int = 1, stage:str|None = None) -> None:
+        '''
+        累加计数，未指定stage时记录到当前所在阶段
+        '''
+        if stage is None:
+            stage_stack = self._stage_stack
+            stage = stage_stack[-1][0] if stage_stack else "total"
+        counters = self.get_record(stage).counters
+        with self._lock:
+            counters[name] = counters.get(name, 0) + value
+
+    def to_list(self) -> list[dict]:
+        with self._lock:
+            return [asdict(record) for record in self.records.values()]
+
+    def to_json(self, path:Path) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_list(), f, ensure_ascii=False, indent=2)
+
+    def to_csv(self, path:Path) -> None:
+        counter_keys : list[str] = []
+        for record in self.records.values():
+            for key in record.counters:
+                if key not in counter_keys:
+                    counter_keys.append(key)
+
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["pv_id", "stage", "calls", "elapsed", "peak_memory", *counter_keys])
+            for record in self.records.values():
+                writer.writerow([record.pv_id, record.stage, record.calls, f"{record.elapsed:.6f}", record.peak_memory,
+                                 *(record.counters.get(key, 0) for key in counter_keys)])
+
+    def dump_profile(self, path:Path) -> None:
+        if self.profiler:
+            self.profiler.dump_stats(path)
+
+    def log_summary(self) -> None:
+        stage_dict : dict[str,float] = {}
+        for record in self.records.values():
+            stage_dict[record.stage] = stage_dict.get(record.stage, 0.0) + record.elapsed
+        for stage, elapsed in sorted(stage_dict.items(), key=lambda item: item[1], reverse=True):
+            logger.info(f"{stage}: {elapsed:.3f}s")
+
+_report = RunReport()
+
+def get_report() -> RunReport:
+    return _report
+
+def set_report(report:RunReport) -> RunReport:
+    '''
+    替换全局统计对象，返回之前的对象
+    '''
+    global _report
+    pre_report = _report
+    _report = report
+    return pre_report
+
+def stage(name:str):
+    return _report.stage(name)
+
+def count(name:str, value:int = 1, stage:str|None = None) -> None:
+    _report.count(name, value, stage)
@@ -0,0 +1,51 @@
+from auto_creat_mod_spr_db import Manager
+from dataclasses import asdict
+from pathlib import Path
+import argparse
+import logging
+import json
+import sys
+
+logger = logging.getLogger('merge_spr_db')
+
+'''
+合并多个mod_spr_db
+按参数顺序读取，文件名相同时后面的数据库优先（--keep-first时前面的优先）
+冲突的info_id重新分配，id冲突写入--report
+'''
+
+def init_logging(quiet:bool):
+    logging.basicConfig(
+        format='{asctime} {levelname} [{name}]: {message}',
+        style='{',
+        level=logging.WARNING if quiet else logging.INFO,
+        handlers=[logging.StreamHandler()],
+    )
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("db", type=Path, nargs="+", help="要合并的mod_spr_db")
+    parser.add_argument("--output", type=Path, required=True)
+    parser.add_argument("--keep-first", action="store_true", help="文件名相同时保留先出现的数据库中的内容")
+    parser.add_argument("--report", type=Path, default=None, help="以json输出重新分配的info_id与id冲突")
+    parser.add_argument("--strict", action="store_true", help="存在哈希碰撞时返回错误且不写入")
+    parser.add_argument("--quiet", action="store_true")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = get_args()
+    init_logging(args.quiet)
+    manager = Manager(quiet=args.quiet)
+    try:
+        report = manager.merge(args.db, override=not args.keep_first)
+    except (OSError, ValueError) as e:
+        logger.error(e)
+        sys.exit(1)
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(asdict(report), f, ensure_ascii=False, indent=1)
+    if args.strict and report.collision_count:
+        logger.error(f"{report.collision_count} hash collisions, {args.output} not written")
+        sys.exit(1)
+    manager.write_db(args.output)
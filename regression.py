@@ -0,0 +1,146 @@
+from lib.CsfmReader import read_csfm
+from lib.ConvertDSC import DSCManager, read_dsc_command
+from lib.CsfmWriter import SyntheticChartSetting, generate_csfm_data, write_csfm
+from pathlib import Path
+from collections.abc import Generator
+import argparse
+import tempfile
+import hashlib
+import logging
+import json
+import time
+import sys
+
+logger = logging.getLogger('regression')
+
+'''
+DSC输出回归检测
+record : 使用当前代码（参考实现）转换谱面，保存dsc与耗时作为golden
+check  : 使用当前代码（优化后的实现）重新转换，逐条对比dsc指令并给出加速比
+'''
+
+INDEX_NAME = "index.json"
+
+def init_logging():
+    logging.basicConfig(
+        format='{asctime} {levelname} [{name}]: {message}',
+        style='{',
+        level=logging.INFO,
+        handlers=[logging.StreamHandler()],
+    )
+    logging.getLogger('CsfmReader').setLevel(logging.WARNING)
+
+def get_corpus(corpus_path:Path|None, synthetic_count:int, work_path:Path) -> Generator[tuple[str,Path], None, None]:
+    '''
+    返回 (谱面名称, csfm路径)
+    随机谱面使用种子作为名称，保证每次生成的内容一致
+    '''
+    if corpus_path:
+        for csfm_path in sorted(corpus_path.rglob("*.csfm")):
+            yield csfm_path.relative_to(corpus_path).as_posix().replace("/", "_"), csfm_path
+
+    for seed in range(synthetic_count):
+        csfm_path = work_path.joinpath(f"synthetic_{seed}.csfm")
+        setting = SyntheticChartSetting(seed=seed, target_count=500 + seed * 250, tempo_count=2 + seed * 2,
+                                        event_count=seed)
+        write_csfm(csfm_path, generate_csfm_data(setting))
+        yield csfm_path.stem, csfm_path
+
+def convert(csfm_path:Path, repeat:int) -> tuple[bytes, float]:
+    '''
+    返回dsc数据与最快的一次转换耗时（不包含读取csfm）
+    '''
+    csfm_data = read_csfm(csfm_path)
+    best = float("inf")
+    dsc_data = b""
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        dsc_manager = DSCManager()
+        dsc_manager.read_csfm_data(csfm_data)
+        dsc_data = dsc_manager.get_dsc_bytes()
+        best = min(best, time.perf_counter() - start_time)
+    return dsc_data, best
+
+def diff_command(golden:bytes, current:bytes) -> str|None:
+    '''
+    逐条对比指令，返回第一处不同的描述，完全一致时返回None
+    '''
+    try:
+        golden_list = read_dsc_command(golden)
+        current_list = read_dsc_command(current)
+    except ValueError as e:
+        # 无法解析时退回按字节对比
+        offset = next((i for i, (a, b) in enumerate(zip(golden, current)) if a != b), min(len(golden), len(current)))
+        return f"byte {offset}: {e}"
+    for index, (golden_command, current_command) in enumerate(zip(golden_list, current_list)):
+        if golden_command != current_command:
+            return f"#{index}: expected {golden_command}, got {current_command}"
+    if len(golden_list) != len(current_list):
+        index = min(len(golden_list), len(current_list))
+        extra = golden_list[index] if len(golden_list) > index else current_list[index]
+        return f"#{index}: command count {len(golden_list)} -> {len(current_list)}, first extra {extra}"
+    return None
+
+def record(corpus:list[tuple[str,Path]], golden_path:Path, repeat:int) -> None:
+    golden_path.mkdir(parents=True, exist_ok=True)
+    index_dict = {}
+    for name, csfm_path in corpus:
+        dsc_data, elapsed = convert(csfm_path, repeat)
+        golden_path.joinpath(f"{name}.dsc").write_bytes(dsc_data)
+        index_dict[name] = {"source":str(csfm_path), "elapsed":elapsed,
+                            "sha256":hashlib.sha256(dsc_data).hexdigest()}
+        logger.info(f"{name}: {len(read_dsc_command(dsc_data))} commands, {elapsed * 1000:.2f}ms")
+
+    with open(golden_path.joinpath(INDEX_NAME), "w", encoding="utf-8") as f:
+        json.dump(index_dict, f, ensure_ascii=False, indent=2)
+
+def check(corpus:list[tuple[str,Path]], golden_path:Path, repeat:int) -> bool:
+    with open(golden_path.joinpath(INDEX_NAME), encoding="utf-8") as f:
+        index_dict = json.load(f)
+
+    is_ok = True
+    golden_time = current_time = 0.0
+    for name, csfm_path in corpus:
+        if name not in index_dict:
+            logger.warning(f"{name}: 没有对应的golden，跳过")
+            continue
+        dsc_data, elapsed = convert(csfm_path, repeat)
+        golden_data = golden_path.joinpath(f"{name}.dsc").read_bytes()
+        speedup = index_dict[name]["elapsed"] / elapsed if elapsed > 0 else 0.0
+        golden_time += index_dict[name]["elapsed"]
+        current_time += elapsed
+
+        if golden_data == dsc_data:
+            logger.info(f"{name}: OK, {speedup:.2f}x")
+            continue
+        is_ok = False
+        divergence = diff_command(golden_data, dsc_data)
+        if divergence is None:
+            divergence = "commands equal but bytes differ"
+        logger.error(f"{name}: DIFF {divergence}")
+
+    if current_time > 0:
+        logger.info(f"total: {golden_time / current_time:.2f}x")
+    return is_ok
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", choices=("record", "check"))
+    parser.add_argument("--golden", type=Path, default=Path("golden"))
+    parser.add_argument("--corpus", type=Path, default=None, help="包含csfm文件的目录")
+    parser.add_argument("--synthetic", type=int, default=0, help="额外生成的随机谱面数量")
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    init_logging()
+    args = get_args()
+    with tempfile.TemporaryDirectory() as work_dir:
+        corpus = list(get_corpus(args.corpus, args.synthetic, Path(work_dir)))
+        if not corpus:
+            logger.error("没有可用的谱面，请指定--corpus或--synthetic")
+            sys.exit(2)
+        if args.mode == "record":
+            record(corpus, args.golden, args.repeat)
+        elif not check(corpus, args.golden, args.repeat):
+            sys.exit(1)
@@ -1,14 +1,16 @@
-from lib.CsfmReader import read_csfm
+from lib.CsfmReader import open_csfm, read_csfm
 from lib.ConvertDSC import DSCManager
 from lib.CsfmDataClass import Difficulty, ChartInfo
-import FarcCreater
+from lib import Instrument
+from lib.CsfmCatalog import CsfmCatalog
+from lib.AssetStage import AssetStager, LinkMode
 from pathlib import Path
 from collections.abc import Generator
 import logging
 import re
 from dataclasses import dataclass, field, InitVar
 import enum
-import shutil
+import argparse
 import auto_creat_mod_spr_db as db_tool
 
 def init_logging():
@@ -20,49 +22,146 @@ def init_logging():
         handlers=[logging.StreamHandler()],
     )
 
-def get_csfm_file() -> Generator[Path, None, None]:
+def get_csfm_file(catalog_path:Path|None = None) -> Generator[Path, None, None]:
+    if catalog_path:
+        # 使用索引时只对文件做stat扫描，未变化的文件不会重新解析
+        with CsfmCatalog(catalog_path) as catalog:
+            catalog.refresh(Path("input"))
+            entry_list = catalog.entries()
+        for entry in entry_list:
+            yield Path(entry.path)
+        return
+
     for csfm_path in Path("input").rglob("*/*.csfm"):
         if re.match(r"\d+$",csfm_path.parent.name):
             yield csfm_path
 
-chart_info_dict:dict[int,ChartInfo] = {}
+def get_pv_group(catalog_path:Path|None = None) -> Generator[tuple[int, list[Path]], None, None]:
+    '''
+    按pv_id分组，这里只保存路径，谱面在处理该pv时才读取
+    '''
+    pv_dict:dict[int, list[Path]] = {}
+    for csfm_path in get_csfm_file(catalog_path):
+        pv_dict.setdefault(int(csfm_path.parent.name), []).append(csfm_path)
+    yield from sorted(pv_dict.items())
 
-if __name__ == "__main__":
-    init_logging()
-    for csfm_path in get_csfm_file():
-        pv_id = int(csfm_path.parent.name)
-        csfm_data = read_csfm(csfm_path)
-        if not pv_id in chart_info_dict:
-            chart_info_dict.update({pv_id:ChartInfo(pv_id)})
-        
-        if not chart_info_dict[pv_id].meta_data:
-            chart_info_dict[pv_id].update_meta(csfm_data)
+def load_chart_info(pv_id:int, csfm_list:list[Path], cache_dir:Path|None = None) -> ChartInfo:
+    chart_info = ChartInfo(pv_id)
+    for csfm_path in csfm_list:
+        if cache_dir:
+            csfm_data = read_csfm(csfm_path, cache_dir=cache_dir)
+        else:
+            # 按需读取，Targets在导出dsc时才会解析
+            csfm_data = open_csfm(csfm_path)
+        if not chart_info.meta_data:
+            chart_info.update_meta(csfm_data)
+        chart_info.update_chart(csfm_data)
+    return chart_info
+
+def submit_asset(chart_info:ChartInfo, stager:AssetStager) -> None:
+    '''
+    歌曲与视频交给后台复制，与谱面转换同时进行
+    '''
+    src_song:Path = chart_info.meta_data["song_path"]
+    stager.submit(src_song, Path("output", "rom", "sound", "song", f"pv_{chart_info.pv_id:03d}{src_song.suffix}"),
+                  chart_info.pv_id)
+    src_movie:Path|None = chart_info.meta_data["movie_path"]
+    if src_movie and src_movie.exists():
+        # 与pv_db中的movie_file_name一致
+        stager.submit(src_movie, Path("output", chart_info.get_movie_file_name()), chart_info.pv_id)
+
+def wait_asset(stager:AssetStager) -> None:
+    report = Instrument.get_report()
+    with Instrument.stage("wait_asset"):
+        result_list, _ = stager.wait()
+    for result in result_list:
+        with report.pv(result.pv_id):
+            Instrument.count("bytes", result.size, stage="copy_asset")
+            Instrument.count(result.method, stage="copy_asset")
+            report.get_record("copy_asset").elapsed += result.elapsed
+
+def export_pv(chart_info:ChartInfo, stager:AssetStager, export_spr:bool = True, farc_setting = None) -> list[str]:
+    submit_asset(chart_info, stager)
+    with Instrument.stage("export_chart"):
+        return chart_info.export_chart(export_spr=export_spr, farc_setting=farc_setting)
 
-        chart_info_dict[pv_id].update_chart(csfm_data)
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--report", type=Path, default=None,
+                        help="输出各PV各阶段耗时统计，后缀为.csv时输出csv，否则输出json")
+    parser.add_argument("--profile", type=Path, default=None,
+                        help="启用cProfile并将结果保存到指定路径")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="使用tracemalloc记录各阶段内存峰值")
+    parser.add_argument("--catalog", type=Path, default=None,
+                        help="曲库索引文件，指定后增量扫描input")
+    parser.add_argument("--cache-dir", type=Path, default=None,
+                        help="csfm解析结果缓存目录，源文件未变化时跳过解析")
+    parser.add_argument("--dsc-only", action="store_true",
+                        help="只生成dsc与pv_db，不生成2D图与mod_spr_db")
+    parser.add_argument("--link-mode", type=LinkMode, default=LinkMode.REFLINK, choices=list(LinkMode),
+                        help="歌曲与视频的复制方式，不支持时退回普通复制")
+    parser.add_argument("--io-workers", type=int, default=4, help="后台复制使用的线程数")
+    parser.add_argument("--encoder", default="auto", help="贴图编码后端，auto为使用第一个可用的后端")
+    parser.add_argument("--preset", choices=("draft", "release", "raw"), default="release",
+                        help="draft使用DXT5快速编码，release使用指定的压缩格式，raw不压缩")
+    parser.add_argument("--farc-level", type=int, choices=range(10), default=None, metavar="0-9",
+                        help="输出gzip压缩的farc并指定压缩等级，未指定时不压缩")
+    parser.add_argument("--update-db", action="store_true",
+                        help="增量更新mod_spr_db，只读取变化的farc并保留已有的info_id")
+    parser.add_argument("--db-hash", action="store_true",
+                        help="增量更新时farc的大小或修改时间变化后再比较内容哈希")
+    return parser.parse_args()
 
+def export_report(args:argparse.Namespace) -> None:
+    report = Instrument.get_report()
+    report.log_summary()
+    if args.report:
+        if args.report.suffix.lower() == ".csv":
+            report.to_csv(args.report)
+        else:
+            report.to_json(args.report)
+    if args.profile:
+        report.dump_profile(args.profile)
+
+if __name__ == "__main__":
+    init_logging()
+    args = get_args()
+    Instrument.set_report(Instrument.RunReport(profile=bool(args.profile), trace_memory=args.trace_memory))
+    farc_setting = None
+    if not args.dsc_only:
+        import FarcCreater
+        farc_setting = FarcCreater.FarcSetting(args.encoder, FarcCreater.EncodePreset(args.preset), args.farc_level)
     pv_db_list = []
 
-    for chart_info in chart_info_dict.values():
-        src_song:Path = chart_info.meta_data["song_path"]
-        dst_song = Path("output", "rom", "sound", "song", f"pv_{chart_info.pv_id:03d}{src_song.suffix}")
-        shutil.copy2(src_song, dst_song)
-        
-        pv_db_list += chart_info.export_chart()
+    with AssetStager(args.link_mode, args.io_workers) as stager:
+        # 逐个pv读取并导出，导出后谱面数据即可释放，只保留pv_db
+        for pv_id, csfm_list in get_pv_group(args.catalog):
+            with Instrument.get_report().pv(pv_id):
+                chart_info = load_chart_info(pv_id, csfm_list, args.cache_dir)
+                pv_db_list += export_pv(chart_info, stager, not args.dsc_only, farc_setting)
+            del chart_info
+        wait_asset(stager)
     
     pv_db_list.sort()
     with open("output//rom//mod_pv_db.txt","w",encoding="utf-8") as f:
         f.write("\n".join(pv_db_list))
-    
-    SPR_DB = db_tool.Manager()
-    spr_path = Path("output\\rom\\2d")
-    farc_list = []
-    for spr in spr_path.iterdir():
-        _temp_file = Path(spr)
-        if _temp_file.suffix.upper() == ".FARC":
-            farc_list.append(_temp_file)
-    if len(farc_list) >0:
-        for farc_file in farc_list:
-            farc_reader = db_tool.read_farc(farc_file)
-            db_tool.add_farc_to_Manager(farc_reader, SPR_DB)
-            
-    SPR_DB.write_db("output\\rom\\2d\\mod_spr_db.bin")
+
+    if not args.dsc_only:
+        SPR_DB = db_tool.Manager()
+        spr_path = Path("output\\rom\\2d")
+        farc_list = []
+        for spr in spr_path.iterdir():
+            _temp_file = Path(spr)
+            if _temp_file.suffix.upper() == ".FARC":
+                farc_list.append(_temp_file)
+        if args.update_db:
+            # 状态文件不放在rom内，避免打包到mod中
+            db_tool.update_db(Path("output\\rom\\2d\\mod_spr_db.bin"), sorted(farc_list),
+                              Path("output\\mod_spr_db_state.json"), args.db_hash, SPR_DB)
+        else:
+            for farc_file in farc_list:
+                farc_reader = db_tool.read_farc(farc_file)
+                db_tool.add_farc_to_Manager(farc_reader, SPR_DB)
+            SPR_DB.write_db("output\\rom\\2d\\mod_spr_db.bin")
+    export_report(args)
@@ -0,0 +1,84 @@
+from pathlib import Path
+import unittest
+import sys
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+from lib.ConvertDSC import NoteManager, resolve_link
+from lib.CsfmDataClass import ComfyNoteID, DSCNoteID, LinkRole
+
+'''
+F2X谱面的Note转换
+'''
+
+def make_target(note_list:list[dict]) -> dict:
+    '''
+    note_list中每个字典只需要写出与默认值不同的列
+    '''
+    default = {"Tick":0, "Type":ComfyNoteID.STAR, "Properties":False, "Hold":False, "Chain":False, "Chance":False,
+               "Position":(0.0, 0.0), "Angle":0.0, "Frequency":0.0, "Amplitude":0.0, "Distance":0.0,
+               "Long":False, "Double":False, "Rush":False, "Link":False,
+               "EndTick":-1, "ReferenceID":-1, "PreviousID":-1, "NextID":-1}
+    return {key:tuple(note.get(key, value) for note in note_list) for key, value in default.items()}
+
+def get_note_id(data_dict:dict) -> list[tuple[int, int]]:
+    note_manager = NoteManager()
+    note_manager.read_note(data_dict)
+    return [(note.tick, note.get_dsc_note_id()) for note in note_manager.data_list]
+
+class NoteTypeTest(unittest.TestCase):
+    def test_long(self) -> None:
+        data_dict = make_target([{"Tick":0, "Type":ComfyNoteID.TRIANGLE, "Long":True, "EndTick":24},
+                                 {"Tick":12, "Type":ComfyNoteID.CIRCLE}])
+        self.assertEqual(get_note_id(data_dict), [(0, DSCNoteID.TRIANGLE_LONG), (12, DSCNoteID.CIRCLE),
+                                                  (24, DSCNoteID.TRIANGLE_LONG)])
+
+    def test_double_and_rush(self) -> None:
+        data_dict = make_target([{"Tick":0, "Type":ComfyNoteID.SQUARE, "Double":True},
+                                 {"Tick":0, "Type":ComfyNoteID.STAR, "Double":True},
+                                 {"Tick":12, "Type":ComfyNoteID.CIRCLE, "Rush":True},
+                                 {"Tick":24, "Type":ComfyNoteID.STAR}])
+        self.assertEqual(get_note_id(data_dict), [(0, DSCNoteID.LEFT_W), (0, DSCNoteID.STAR_W),
+                                                  (12, DSCNoteID.CIRCLE_RUSH), (24, DSCNoteID.STAR)])
+
+    def test_reference_id(self) -> None:
+        '''
+        ReferenceID不影响转换结果
+        '''
+        note_list = [{"Tick":0, "Type":ComfyNoteID.SQUARE, "Double":True},
+                     {"Tick":0, "Type":ComfyNoteID.CROSS, "Double":True}]
+        reference_list = [{**note_list[0], "ReferenceID":1}, {**note_list[1], "ReferenceID":0}]
+        self.assertEqual(get_note_id(make_target(note_list)), get_note_id(make_target(reference_list)))
+
+    def test_ft_chart(self) -> None:
+        '''
+        没有F2X专有Note时按FT转换
+        '''
+        data_dict = make_target([{"Tick":0, "Type":ComfyNoteID.TRIANGLE, "Hold":True},
+                                 {"Tick":12, "Type":ComfyNoteID.SLIDE_L}])
+        self.assertEqual(get_note_id(data_dict), [(0, DSCNoteID.TRIANGLE_HOLD), (12, DSCNoteID.SLIDE_L)])
+
+class LinkTest(unittest.TestCase):
+    def test_link_chain(self) -> None:
+        data_dict = make_target([{"Tick":tick * 12, "Link":True,
+                                  "PreviousID":index - 1, "NextID":index + 1 if index < 3 else -1}
+                                 for index, tick in enumerate(range(4))])
+        self.assertEqual([note_id for _, note_id in get_note_id(data_dict)],
+                         [DSCNoteID.LINK_STAR_START, DSCNoteID.LINK_STAR_START,
+                          DSCNoteID.LINK_STAR_START, DSCNoteID.LINK_STAR_END])
+
+    def test_resolve_link(self) -> None:
+        role_list, span_list = resolve_link([1, 2, -1], [-1, 0, 1], (True, True, True))
+        self.assertEqual(role_list, [LinkRole.HEAD, LinkRole.MIDDLE, LinkRole.TAIL])
+        self.assertEqual(span_list, [(0, 2)])
+
+    def test_resolve_claimed_link(self) -> None:
+        '''
+        2号Note的下一个Note已属于0号开始的连接
+        '''
+        role_list, span_list = resolve_link([1, -1, 1], [-1, 0, -1], (True, True, True))
+        self.assertEqual(role_list, [LinkRole.HEAD, LinkRole.TAIL, LinkRole.NONE])
+        self.assertEqual(span_list, [(0, 1)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import tempfile
+import unittest
+import sys
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+try:
+    from PIL import Image
+    import FarcCreater
+except ImportError:
+    FarcCreater = None
+
+import auto_creat_mod_spr_db as db_tool
+
+'''
+多个Farc与Manager在不同线程中同时构建
+结果需要与逐个构建时一致
+'''
+
+THREAD_COUNT = 4
+TEXTURE_COUNT = 16
+
+def build_farc(index:int, export_path:Path) -> tuple[list[int], bytes]:
+    setting = FarcCreater.FarcSetting(preset=FarcCreater.EncodePreset.RAW, farc_level=6, farc_workers=1)
+    farc = FarcCreater.Farc(FarcCreater.Compression.RGBA, setting=setting)
+    id_list = []
+    for i in range(TEXTURE_COUNT):
+        texture_id = farc.add_texture(Image.new("RGBA", (16, 16), (index, i, 0, 255)))
+        farc.add_sprite(f"SPRITE_{index}_{i}", setting=(texture_id, 0, 0, 16, 16))
+        id_list.append(texture_id)
+    farc.export_farc(f"spr_test_{index}", export_path)
+    return id_list, db_tool.read_farc(export_path.joinpath(f"spr_test_{index}.farc")).data
+
+def build_db(index:int, export_path:Path) -> tuple[list[int], bytes]:
+    manager = db_tool.Manager(quiet=True)
+    for i in range(TEXTURE_COUNT):
+        info_id = manager.info_id.allocate()
+        file_str = f"spr_test_{index}_{i}.bin"
+        manager.add_spr(db_tool.SpriteSetInfo({"id":index * 1000 + i, "info_str":file_str[:-4].upper(),
+                                               "file_str":file_str, "info_id":info_id}))
+        manager.add_spr(db_tool.Sprites({"id":index * 1000 + i, "info_str":f"SPRITE_{index}_{i}",
+                                         "index":0, "is_spr":True, "info_id":info_id}))
+    db_path = export_path.joinpath(f"mod_spr_db_{index}.bin")
+    manager.write_db(db_path)
+    return [sprinfo.info_id for sprinfo in manager.sprinfo_list], db_path.read_bytes()
+
+class ParallelBuildTest(unittest.TestCase):
+    def run_parallel(self, build_func) -> None:
+        with tempfile.TemporaryDirectory() as serial_dir, tempfile.TemporaryDirectory() as parallel_dir:
+            serial_list = [build_func(index, Path(serial_dir)) for index in range(THREAD_COUNT)]
+            with ThreadPoolExecutor(max_workers=THREAD_COUNT) as executor:
+                parallel_list = list(executor.map(build_func, range(THREAD_COUNT), [Path(parallel_dir)] * THREAD_COUNT))
+
+        for (serial_id, serial_data), (parallel_id, parallel_data) in zip(serial_list, parallel_list):
+            self.assertEqual(parallel_id, list(range(TEXTURE_COUNT)))
+            self.assertEqual(parallel_id, serial_id)
+            self.assertEqual(parallel_data, serial_data)
+
+    @unittest.skipIf(FarcCreater is None, "需要kkdlib与PIL")
+    def test_farc(self) -> None:
+        self.run_parallel(build_farc)
+
+    def test_manager(self) -> None:
+        self.run_parallel(build_db)
+
+if __name__ == "__main__":
+    unittest.main()